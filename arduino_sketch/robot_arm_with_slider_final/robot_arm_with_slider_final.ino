@@ -35,6 +35,7 @@ const int cellWidthCMSorted = 7;
 String sliderInput = "";
 String robotInput = "";
 String sortInput = "";
+String directTray = "";   // Tray code sent with the pick command (read by the tray camera)
 bool waitingForInitialInputs = true;
 bool waitingForSortInput = false;
 
@@ -65,11 +66,25 @@ void loop() {
   if (waitingForInitialInputs && Serial.available() > 0) {
     String inStr = Serial.readStringUntil('\n');
     inStr.trim();
+    if (inStr == "PING") {
+      // Readiness handshake from the host, which may have reconnected without a reset
+      Serial.println("READY");
+      Serial.println("Enter slider position and robot arm action separated by space, e.g.: B c");
+      return;
+    }
     int spaceIdx = inStr.indexOf(' ');
     // No input validation! Assumes input is always correct format.
     sliderInput = inStr.substring(0, spaceIdx);
     robotInput = inStr.substring(spaceIdx+1);
 
+    // Optional last token with the destination tray, e.g. "C a b2"
+    directTray = "";
+    int lastSpaceIdx = inStr.lastIndexOf(' ');
+    String lastToken = inStr.substring(lastSpaceIdx+1);
+    if (lastSpaceIdx > spaceIdx && lastToken.length() == 2 && lastToken[0] == 'b' && isDigit(lastToken[1])) {
+      directTray = lastToken;
+    }
+
     waitingForInitialInputs = false;
 
     // --- Workflow Update ---
@@ -88,6 +103,19 @@ void loop() {
     Serial.println(robotInput);
     dispatchFunction(robotInput[0]);
 
+    if (directTray.length() > 0) {
+      // Tray already known: skip the scanning area and sort straight away
+      Serial.print("Sorting directly to ");
+      Serial.println(directTray);
+      triggerSortFunction(directTray);
+      Serial.println("ROUND_COMPLETE");
+      Serial.println("Returning slider to home position...");
+      homeStepper();
+      waitingForInitialInputs = true;
+      Serial.println("Enter slider position and robot arm action separated by space, e.g.: B c");
+      return;
+    }
+
     // 3. Move slider to scanningAreaCM
     Serial.print("Moving slider to scanning area (");
     Serial.print(scanningAreaCM);
@@ -108,9 +136,28 @@ void loop() {
   else if (waitingForSortInput && Serial.available() > 0) {
     String inStr = Serial.readStringUntil('\n');
     inStr.trim();
+    if (inStr == "PING") {
+      // The host reconnected while an item waits at the scanning area
+      Serial.println("READY SORT");
+      return;
+    }
     // No input validation! Assumes sort input always correct.
     sortInput = inStr;
 
+    if (sortInput == "x") {
+      // The host saw the item still in the tray: nothing to sort
+      Serial.println("Pick missed, skipping sort");
+      moveServosSmooth(currentPulse, defaultPulse);
+      delay(1000);
+      Serial.println("ROUND_ABORTED");
+      Serial.println("Returning slider to home position...");
+      homeStepper();
+      waitingForInitialInputs = true;
+      waitingForSortInput = false;
+      Serial.println("Enter slider position and robot arm action separated by space, e.g.: B c");
+      return;
+    }
+
     // --- Workflow Update ---
     // 1. Trigger scanningpick
     Serial.println("Triggering scanningpick()");
@@ -1,16 +1,37 @@
 import cv2
 import numpy as np
-import json
 import time
-import random
+import threading
+from collections import namedtuple
+from camera_manager import get_camera
+from cell_map import load_cell_map
+from background_model import get_background_model, prepare_gray
+from automated_tray_sorting import get_decoders
+from qr_decoders import decode_first
+from slider_model import schedule_picks
 
 MIN_AREA = 900
 MAX_AREA = 90000
 OTSU_SENSITIVITY = 22
+TRAY_CODES = ('b1', 'b2', 'b3', 'b4')
+CELL_QR_UPSCALE = 2.0   # Cell crops are small in the overhead view; enlarge before decoding
+PICK_MIN_CHANGED_AREA = MIN_AREA  # Changed pixels in the cell below which a pick missed
+ARM_ACTIONS = ('a', 'b', 'c')  # Pick poses in the sketch's dispatchFunction, one per tray row
+# Tray rows each pick pose reaches. The sketch's poses only reach their own
+# row; a pose added for several rows becomes an alternative for each of them
+ARM_REACH = {'a': ('a',), 'b': ('b',), 'c': ('c',)}
+ARM_PRIOR = 1.0             # Starting score of the row's own action; other actions start at half
+STABLE_PIXEL_DELTA = 12     # Grey-level change between frames that counts a pixel as moving
+STABLE_MAX_CHANGED = 0.002  # Tray is still when fewer than this fraction of its pixels move
+STABLE_FRAMES = 3           # Consecutive still frames needed before capturing
+STABLE_ATTEMPTS = 3         # Settle waits before giving up on a tray that keeps moving
+TRAY_WATCH_INTERVAL_SEC = 0.2  # How often the empty-tray watcher looks at the camera
+TRAY_WATCH_SCALE = 0.25     # The watcher compares downscaled frames; a refill is a large change
+TRAY_CHANGE_MIN = 0.01      # Fraction of tray pixels that must change to wake the watcher
 
-def load_cell_labels(filename="tray_cells.json"):
-    with open(filename, "r") as f:
-        return json.load(f)
+# A planned pick: cell label, tray code read by the tray camera (or None), the
+# slider model's expected seconds for the round and all occupied cells in the frame
+CellSelection = namedtuple('CellSelection', ['cell', 'code', 'expected_sec', 'detected'])
 
 def calculate_difference_otsu(img, bg_img):
     bg_gray = cv2.cvtColor(bg_img, cv2.COLOR_BGR2GRAY)
@@ -24,78 +45,370 @@ def calculate_difference_otsu(img, bg_img):
         diff = cv2.GaussianBlur(otsu_thresh, (5,5), 0)
     return diff
 
-def identify_valid_contours(contours, height, width):
-    valid_indices = []
-    for idx, cnt in enumerate(contours):
-        area = cv2.contourArea(cnt)
-        x, y, w, h = cv2.boundingRect(cnt)
-        edge_noise = x == 0 or y == 0 or (x + w) == width or (y + h) == height
-        if MIN_AREA < area < MAX_AREA and not edge_noise:
-            valid_indices.append(idx)
-    return valid_indices
-
-def assign_cell(cx, cy, cell_labels):
-    for cell in cell_labels:
-        x, y, w, h = cell["x"], cell["y"], cell["w"], cell["h"]
-        if x <= cx <= x+w and y <= cy <= y+h:
-            return cell["label"]
-    return None
-
-def select_random_cell_and_format(delay_sec=2):
-    cell_labels = load_cell_labels("tray_cells.json")
-    bg_img = cv2.imread("background.jpg")
-    if bg_img is None:
+def calculate_difference_otsu_prepared(img_blur, bg_blur):
+    """Same as calculate_difference_otsu, for frames already passed through prepare_gray()."""
+    diff_gray = cv2.absdiff(bg_blur, img_blur)
+    ret, otsu_thresh = cv2.threshold(diff_gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    if ret < OTSU_SENSITIVITY:
+        diff = np.zeros_like(diff_gray)
+    else:
+        diff = cv2.GaussianBlur(otsu_thresh, (5,5), 0)
+    return diff
+
+def find_valid_blobs(diff):
+    """
+    Finds the outer contours of the foreground blobs in the difference mask
+    and applies the area and edge-noise filters as array masks; moments are
+    only computed for the blobs that pass. A tray mask holds a handful of
+    blobs, where findContours (about 0.15 ms per frame in vision_benchmark)
+    is much cheaper than connectedComponentsWithStats (about 2.7 ms), which
+    labels every pixel and only pays off at around a thousand blobs.
+    Returns:
+        tuple: (centroids, stats) of the valid blobs; centroids is an Nx2
+        float array, stats holds the matching x, y, w, h, area rows.
+    """
+    height, width = diff.shape[:2]
+    contours, _ = cv2.findContours(diff, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return np.empty((0, 2)), np.empty((0, 5))
+    rects = np.array([cv2.boundingRect(cnt) for cnt in contours])
+    area = np.array([cv2.contourArea(cnt) for cnt in contours])
+    x, y, w, h = rects.T
+    edge_noise = (x == 0) | (y == 0) | (x + w == width) | (y + h == height)
+    valid = np.flatnonzero((area > MIN_AREA) & (area < MAX_AREA) & ~edge_noise)
+    # Area is above MIN_AREA, so m00 is never zero here
+    moments = [cv2.moments(contours[idx]) for idx in valid]
+    centroids = np.array([(m['m10'] / m['m00'], m['m01'] / m['m00']) for m in moments]).reshape(-1, 2)
+    return centroids, np.column_stack((rects[valid], area[valid]))
+
+def detect_occupied_cells(frame, cell_map=None, learn=True):
+    """
+    Returns the labels of all tray cells that contain an object in `frame`,
+    or None if there is no background reference.
+    With `learn`, a frame that shows a clearly empty tray is blended into
+    the in-memory background model.
+    """
+    height, width = frame.shape[:2]
+    if cell_map is None:
+        cell_map = load_cell_map("tray_cells.json", (height, width))
+    background = get_background_model()
+    bg_blur = background.reference()
+    if bg_blur is None:
         print("Error: 'background.jpg' not found. Run save_background_image.py first.")
         return None
 
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("Error: Could not open camera.")
-        return None
+    frame_blur = prepare_gray(frame)
+    diff = calculate_difference_otsu_prepared(frame_blur, bg_blur)
+    centroids, _ = find_valid_blobs(diff)
+    if len(centroids) == 0:
+        # Only learn when hardly any pixel differs, so an object that was
+        # missed by the blob filters is never absorbed into the background
+        if learn and np.count_nonzero(cv2.absdiff(bg_blur, frame_blur) > OTSU_SENSITIVITY) < MIN_AREA:
+            background.update(frame_blur)
+        return []
 
-    print(f"Waiting {delay_sec} seconds before capturing tray image...")
-    for _ in range(10):
-        cap.read()
-    time.sleep(delay_sec)
+    centroids = centroids.astype(int)
+    xs, ys = centroids[:, 0], centroids[:, 1]
+    detected_cells = [label for label in cell_map.assign_many(xs, ys) if label]
+    for cell_label in detected_cells:
+        print(f"Detected object in cell: {cell_label}")
+    return detected_cells
 
-    ret, frame = cap.read()
-    if not ret:
-        print("Failed to grab frame.")
-        cap.release()
-        return None
+def read_cell_codes(frame, cell_labels, cell_map=None):
+    """
+    Decodes the QR code on the item in each of `cell_labels` from the
+    overhead frame, looking only inside that cell's calibrated rectangle.
+    Returns:
+        dict: cell label -> tray code, or None where no valid code was read.
+    """
+    if cell_map is None:
+        cell_map = load_cell_map("tray_cells.json", frame.shape)
+    decoders = get_decoders()
+    rects = {cell["label"]: cell for cell in cell_map.cells}
+    codes = {}
+    for label in cell_labels:
+        cell = rects.get(label)
+        codes[label] = None
+        if cell is None:
+            continue
+        crop = frame[max(cell["y"], 0):cell["y"] + cell["h"], max(cell["x"], 0):cell["x"] + cell["w"]]
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        gray = cv2.resize(gray, None, fx=CELL_QR_UPSCALE, fy=CELL_QR_UPSCALE, interpolation=cv2.INTER_CUBIC)
+        reads = decode_first(decoders, gray)
+        if reads and reads[0].data in TRAY_CODES:
+            codes[label] = reads[0].data
+    return codes
 
-    diff = calculate_difference_otsu(frame, bg_img)
-    contours, _ = cv2.findContours(diff, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    height, width = frame.shape[:2]
-    valid_indices = identify_valid_contours(contours, height, width)
-
-    detected_cells = []
-    for idx in valid_indices:
-        cnt = contours[idx]
-        M = cv2.moments(cnt)
-        cx = int(M['m10']/M['m00']) if M['m00'] != 0 else None
-        cy = int(M['m01']/M['m00']) if M['m00'] != 0 else None
-        if cx is not None and cy is not None:
-            cell_label = assign_cell(cx, cy, cell_labels)
-            if cell_label:
-                detected_cells.append(cell_label)
-                print(f"Detected object in cell: {cell_label}")
-
-    cap.release()
-    cv2.destroyAllWindows()
+def wait_for_stable_frame(camera, max_wait_sec, stable_frames=STABLE_FRAMES):
+    """
+    Watches consecutive frames until the tray region (the union of the
+    tray_cells.json rectangles) has changed by less than STABLE_MAX_CHANGED
+    of its pixels for `stable_frames` frames in a row, so the capture is not
+    taken while the arm is still over the tray. Gives up after `max_wait_sec`
+    and returns the newest frame anyway.
+    Returns:
+        tuple: (frame, settled), or (None, False) if no frame arrived.
+    """
+    start = time.monotonic()
+    deadline = start + max_wait_sec
+    # Only accept frames grabbed from now on, not one buffered before the call
+    frame, timestamp = camera.get_frame(newer_than=start)
+    if frame is None:
+        return None, False
+    mask = load_cell_map("tray_cells.json", frame.shape).tray_mask
+    limit = STABLE_MAX_CHANGED * max(np.count_nonzero(mask), 1)
+    previous = prepare_gray(frame)
+    still = 0
+    while still < stable_frames:
+        if time.monotonic() >= deadline:
+            return frame, False
+        frame, timestamp = camera.get_frame(newer_than=timestamp, timeout=max(deadline - time.monotonic(), 0.1))
+        if frame is None:
+            return None, False
+        current = prepare_gray(frame)
+        moving = np.count_nonzero((cv2.absdiff(previous, current) > STABLE_PIXEL_DELTA) & mask)
+        still = still + 1 if moving < limit else 0
+        previous = current
+    print(f"Tray settled after {time.monotonic() - start:.2f}s")
+    return frame, True
+
+def _watch_image(frame):
+    small = cv2.resize(frame, None, fx=TRAY_WATCH_SCALE, fy=TRAY_WATCH_SCALE, interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
 
+def wait_for_tray_change(camera_index=0, timeout_sec=None, cancel=None, reference_frame=None):
+    """
+    Idles on the tray camera until the tray region differs noticeably from
+    `reference_frame`, e.g. because the operator refilled it. Pass the frame
+    the tray was last judged on, so a refill that happened before the call
+    still counts; without one, the first frame of the call is the reference.
+    Looks at a downscaled frame every TRAY_WATCH_INTERVAL_SEC, so waiting
+    costs almost no CPU. Returns True on a change, False on timeout, when
+    `cancel` (a threading.Event) is set or the camera fails.
+    """
+    cancel = cancel or threading.Event()
+    camera = get_camera(camera_index)
+    frame = reference_frame
+    if frame is None:
+        frame, _ = camera.get_frame()
+        if frame is None:
+            return False
+    reference = _watch_image(frame)
+    tray_mask = load_cell_map("tray_cells.json", frame.shape).tray_mask
+    mask = cv2.resize(tray_mask.view(np.uint8), reference.shape[::-1], interpolation=cv2.INTER_NEAREST) > 0
+    limit = TRAY_CHANGE_MIN * max(np.count_nonzero(mask), 1)
+    deadline = None if timeout_sec is None else time.monotonic() + timeout_sec
+    while not cancel.wait(TRAY_WATCH_INTERVAL_SEC):
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        frame, _ = camera.get_frame()
+        if frame is None:
+            return False
+        changed = np.count_nonzero((cv2.absdiff(reference, _watch_image(frame)) > STABLE_PIXEL_DELTA) & mask)
+        if changed >= limit:
+            return True
+    return False
+
+def capture_tray_frame(delay_sec=2, camera_index=0):
+    """
+    Captures the tray as soon as it is still, waiting up to `delay_sec`
+    STABLE_ATTEMPTS times; a frame taken while something still moves over
+    the tray is never used. With `delay_sec=0` the next frame is used as is.
+    Returns None if the tray never settled or no frame arrived.
+    """
+    camera = get_camera(camera_index)
+
+    if delay_sec > 0:
+        for _ in range(STABLE_ATTEMPTS):
+            frame, settled = wait_for_stable_frame(camera, delay_sec)
+            if frame is None or settled:
+                break
+            print(f"Tray still changing after {delay_sec} seconds; waiting again.")
+        else:
+            print("Tray did not settle; not picking from a moving scene.")
+            return None
+    else:
+        # Only accept a frame grabbed from now on, not one buffered before it
+        frame, _ = camera.get_frame(newer_than=time.monotonic())
+    if frame is None:
+        print("Failed to grab frame.")
+    return frame
+
+def plan_pick(frame, with_codes=False, avoid=None):
+    """
+    Picks the occupied cell in `frame` with the shortest expected round
+    according to the slider travel model (see slider_model.schedule_picks).
+    With `with_codes`, also reads the items' QR codes in the same frame, so
+    items whose code was read are planned on the direct path. Cells in
+    `avoid` are not picked.
+    Returns:
+        CellSelection, or None if no cell can be picked.
+    """
+    detected_cells = detect_occupied_cells(frame)
     if not detected_cells:
         print("No objects detected in any cell.")
         return None
 
-    selected_cell = random.choice(detected_cells)
-    print(f"Randomly selected cell for Arduino: {selected_cell}")
+    avoid = avoid or ()
+    candidates = [cell for cell in detected_cells if cell not in avoid]
+    if not candidates:
+        print(f"Only skipped cells are occupied: {', '.join(detected_cells)}")
+        return None
+
+    codes = {}
+    if with_codes:
+        codes = read_cell_codes(frame, candidates)
+        print(f"Tray codes read from overhead: {codes}")
+    plan = schedule_picks(candidates, codes)
+    print("Pick plan (expected s/round): " + ", ".join(f"{cell} {seconds:.1f}" for cell, seconds in plan))
+    selected_cell, expected_sec = plan[0]
+    print(f"Selected cell for Arduino: {selected_cell} (expected {expected_sec:.1f}s)")
+    return CellSelection(selected_cell, codes.get(selected_cell), expected_sec, tuple(detected_cells))
+
+def select_cell_and_format(delay_sec=2, camera_index=0, with_codes=False, details=False, avoid=None):
+    """
+    capture_tray_frame() followed by plan_pick(). Returns the cell label,
+    or with `details` the CellSelection; None if the tray never settled or
+    no cell can be picked.
+    """
+    frame = capture_tray_frame(delay_sec, camera_index)
+    if frame is None:
+        return None
+    selection = plan_pick(frame, with_codes, avoid)
+    if selection is None or details:
+        return selection
+    return selection.cell
+
+def choose_arm(cell_label, pick_stats=None, detected_cells=None):
+    """
+    Returns the arm action for a cell: the row letter of the label ("B c"
+    is picked with 'c') until the recorded outcomes in `pick_stats`
+    ({(cell, arm): (attempts, successes)}) show another action clears the
+    cell more reliably. A row action that missed twice in a row is
+    outscored by an untried alternative, which is then tried.
+    Only actions whose ARM_REACH includes the cell's row are alternatives,
+    and only while the other rows they reach are empty in the same column
+    of `detected_cells`; without a detection the row action is kept. With
+    the sketch's poses every row has just its own action.
+    """
+    pick_stats = pick_stats or {}
+    parts = cell_label.split()
+    row = parts[1] if len(parts) > 1 and parts[1] in ARM_ACTIONS else ARM_ACTIONS[0]
+    if detected_cells is None:
+        return row
+    # Never reach into a neighbouring cell that still holds an item
+    allowed = [
+        arm for arm in ARM_ACTIONS
+        if arm == row or (row in ARM_REACH.get(arm, ()) and not any(
+            f"{parts[0]} {other}" in detected_cells for other in ARM_REACH[arm] if other != row))
+    ]
+
+    def score(arm):
+        attempts, successes = pick_stats.get((cell_label, arm), (0, 0))
+        prior = ARM_PRIOR if arm == row else ARM_PRIOR / 2
+        return (successes + prior) / (attempts + 1), arm == row
+
+    return max(allowed, key=score)
+
+def capture_tray_reference(camera_index=0):
+    """Prepared grey frame of the tray right before a pick, for verify_pick()."""
+    frame, _ = get_camera(camera_index).get_frame(newer_than=time.monotonic())
+    return None if frame is None else prepare_gray(frame)
+
+def verify_pick(cell_label, reference, camera_index=0):
+    """
+    Compares the picked cell in a fresh tray frame with `reference` from
+    capture_tray_reference(). A cell that barely changed still holds its
+    item; a changed cell only counts as picked if no object is detected in
+    it any more, so an item that was only pushed around is a miss too.
+    Returns True (picked), False (missed) or None if no frame was available.
+    """
+    frame, _ = get_camera(camera_index).get_frame(newer_than=time.monotonic())
+    if frame is None:
+        return None
+    cell_map = load_cell_map("tray_cells.json", frame.shape)
+    if reference is not None and cell_label in cell_map.labels:
+        # Changed pixels per cell in one pass over the label image
+        changed = cell_map.occupancy(calculate_difference_otsu_prepared(prepare_gray(frame), reference))
+        if changed[cell_map.labels.index(cell_label)] < PICK_MIN_CHANGED_AREA:
+            return False
+    detected_cells = detect_occupied_cells(frame, cell_map, learn=False)
+    if detected_cells is None:
+        return None
+    return cell_label not in detected_cells
+
+class NextCellPrefetcher:
+    """
+    Selects the pick cell for the next round in the background while the
+    arm is still busy with the current one. Call start() once the arm has
+    cleared the tray, then take() at the next prompt; the candidate is
+    re-checked against a fresh frame before it is handed out.
+    Candidates are CellSelection tuples; with `with_codes` they carry the
+    tray code read by the tray camera.
+    """
+
+    def __init__(self, camera_index=0, with_codes=False):
+        self.camera_index = camera_index
+        self.with_codes = with_codes
+        self._lock = threading.Lock()
+        self._generation = 0      # Bumped per run and per take(), so late results are dropped
+        self._candidate = None
+        self._done = None         # Event of the run take() waits for
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                # Never run two detections at once; a stale run only has to finish
+                return
+            self._generation += 1
+            self._candidate = None
+            self._done = threading.Event()
+            self._thread = threading.Thread(target=self._prefetch, args=(self._generation, self._done), daemon=True)
+            self._thread.start()
+
+    def _prefetch(self, generation, done):
+        try:
+            # The arm is away from the tray, so no settle delay is needed
+            candidate = select_cell_and_format(
+                delay_sec=0, camera_index=self.camera_index, with_codes=self.with_codes, details=True)
+        except Exception as e:
+            print(f"Cell prefetch error: {e}")
+            candidate = None
+        with self._lock:
+            if generation == self._generation:
+                self._candidate = candidate
+        done.set()
+
+    def take(self, timeout=5):
+        """
+        Returns the prefetched CellSelection if its cell is still occupied
+        in a fresh frame, otherwise None. Clears the prefetch either way; a
+        run that is still busy after `timeout` is discarded when it ends.
+        """
+        with self._lock:
+            done, generation = self._done, self._generation
+            self._done = None
+        if done is None:
+            return None
+        finished = done.wait(timeout)
+        with self._lock:
+            candidate = self._candidate if finished and generation == self._generation else None
+            self._candidate = None
+            self._generation += 1
+        if candidate is None:
+            return None
 
-    # You may need to map this label to Arduino format, e.g. ('A', 'b')
-    # For now, just return the cell label
-    return selected_cell
+        frame, _ = get_camera(self.camera_index).get_frame(newer_than=time.monotonic())
+        if frame is None:
+            return None
+        detected_cells = detect_occupied_cells(frame) or []
+        if candidate.cell not in detected_cells:
+            print(f"Prefetched cell {candidate.cell} is no longer occupied.")
+            return None
+        return candidate._replace(detected=tuple(detected_cells))
 
 # If you want to test this module standalone:
 if __name__ == "__main__":
-    cell = select_random_cell_and_format()
+    cell = select_cell_and_format()
     print("Selected cell:", cell)
\ No newline at end of file
@@ -1,38 +1,59 @@
 import cv2
-import json
 import time
-from pyzbar.pyzbar import decode
+import threading
+from collections import namedtuple, Counter
+import numpy as np
+from camera_manager import get_camera
+from config_cache import get_crop_box, CropBox
+from qr_decoders import QRRead, RoiTracker, build_decoders, decode_first
 
 # Hardcoded JSON path for crop box
 JSON_PATH = "crop_box.json"
 
+# Headless scanning settings
+SCAN_SCALE = 1.0            # Downscale factor for the decoded crop (1.0 = full resolution)
+SCAN_MAX_FPS = 15           # Upper bound on frames decoded per second
+PRECHECK_WIDTH = 64         # Width of the thumbnail used by the QR pre-check
+QR_EDGE_STRENGTH = 40       # Neighbour intensity step counted as an edge
+QR_MIN_EDGE_FRACTION = 0.04 # Fraction of edge pixels needed to attempt a decode
+QR_VOTES_NEEDED = 2         # Agreeing reads that end a voting scan early
+QR_EMPTY_STOP_FRAMES = 10   # Consecutive QR-less frames after which the crop is taken as empty
+QR_DECODERS = ('pyzbar', 'opencv_aruco')  # Backends from qr_decoders.DECODERS, tried in order
+FULL_FRAME_EVERY = 3        # On a miss, decode the whole frame every this many frames
+
+# Outcome of a voting scan; `code` is None when nothing was read
+ScanResult = namedtuple('ScanResult', ['code', 'confidence', 'frames', 'elapsed'])
+
+_decoders = None
+_roi_trackers = {}
+_decoders_lock = threading.Lock()
+
 def load_crop_box(json_path=JSON_PATH):
-    with open(json_path, "r") as f:
-        data = json.load(f)
-        return data["x"], data["y"], data["width"], data["height"]
+    """Returns (x, y, width, height) from the cached crop_box.json."""
+    return tuple(get_crop_box(path=json_path))
 
 def scan_qr_live_cropped_timeout(camera_index=2, timeout_sec=5):
     """
     Scans for a QR code in a cropped region from a live camera feed.
     Crop region is loaded from crop_box.json.
+    Frames come from the shared camera manager, so the device stays open between scans.
     If no QR code is detected within `timeout_sec` seconds, returns 'b4'.
     Returns:
         str: Decoded QR code data, or 'b4' if not found.
     """
     crop_x, crop_y, crop_width, crop_height = load_crop_box()
-    cap = cv2.VideoCapture(camera_index)
-    if not cap.isOpened():
-        print(f"Failed to open camera at index {camera_index}")
-        return "b4"
+    camera = get_camera(camera_index)
 
     start_time = time.time()
+    last_timestamp = time.monotonic()
     qr_data = None
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        frame, timestamp = camera.get_frame(newer_than=last_timestamp)
+        if frame is None:
             print("Failed to read from camera.")
             break
+        last_timestamp = timestamp
 
         # Draw the virtual box for user alignment
         preview = frame.copy()
@@ -47,9 +68,9 @@ def scan_qr_live_cropped_timeout(camera_index=2, timeout_sec=5):
 
         # Crop area for QR detection
         cropped = frame[crop_y:crop_y + crop_height, crop_x:crop_x + crop_width]
-        decoded_objects = decode(cropped)
-        if decoded_objects:
-            qr_data = decoded_objects[0].data.decode("utf-8")
+        reads = decode_first(get_decoders(), cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY))
+        if reads:
+            qr_data = reads[0].data
             print("QR Code detected:", qr_data)
             break
 
@@ -63,8 +84,198 @@ def scan_qr_live_cropped_timeout(camera_index=2, timeout_sec=5):
             print("User quit program.")
             break
 
-    cap.release()
     cv2.destroyAllWindows()
 
     # If nothing detected, return 'b4' as default
-    return qr_data if qr_data else "b4"
\ No newline at end of file
+    return qr_data if qr_data else "b4"
+
+def looks_like_qr(gray):
+    """
+    Cheap pre-check for a QR-like pattern: QR modules produce many sharp
+    black/white transitions, while an empty scan area is mostly flat.
+    """
+    h, w = gray.shape[:2]
+    if w > PRECHECK_WIDTH:
+        thumb = cv2.resize(gray, (PRECHECK_WIDTH, max(1, h * PRECHECK_WIDTH // w)), interpolation=cv2.INTER_AREA)
+    else:
+        thumb = gray
+    steps = np.abs(np.diff(thumb.astype(np.int16), axis=1))
+    return np.count_nonzero(steps > QR_EDGE_STRENGTH) >= QR_MIN_EDGE_FRACTION * steps.size
+
+def get_decoders():
+    """The QR_DECODERS backends, built once."""
+    global _decoders
+    with _decoders_lock:
+        if _decoders is None:
+            _decoders = build_decoders(QR_DECODERS)
+        return _decoders
+
+def get_roi_tracker(camera_index):
+    """The shared RoiTracker for a scan camera."""
+    with _decoders_lock:
+        tracker = _roi_trackers.get(camera_index)
+        if tracker is None:
+            tracker = RoiTracker()
+            _roi_trackers[camera_index] = tracker
+        return tracker
+
+def _decode_region(decoders, frame, region, scale, precheck=True):
+    """Decodes one crop of `frame`; returns (passed pre-check, QRRead in frame coordinates or None)."""
+    gray = cv2.cvtColor(frame[region.slices], cv2.COLOR_BGR2GRAY)
+    if scale != 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if precheck and not looks_like_qr(gray):
+        return False, None
+    reads = decode_first(decoders, gray)
+    if not reads:
+        return True, None
+    x, y, w, h = (v / scale for v in reads[0].rect)
+    return True, QRRead(reads[0].data, (region.x + x, region.y + y, w, h))
+
+def scan_qr_voting(camera_index=2, timeout_sec=5, votes_needed=QR_VOTES_NEEDED,
+                   empty_stop_frames=QR_EMPTY_STOP_FRAMES, scale=SCAN_SCALE, max_fps=SCAN_MAX_FPS, cancel=None):
+    """
+    Production QR scan without any GUI calls.
+    Each frame is decoded in the ROI tracked from earlier reads, then in
+    the calibrated crop box, with the QR_DECODERS backends in order; every
+    FULL_FRAME_EVERY-th frame without a read also tries the full frame.
+    Reads are counted per code, and the scan returns as soon as one code
+    has `votes_needed` reads, or early when `empty_stop_frames` frames in a
+    row show no QR-like pattern before anything was read. Paces itself to
+    the decoder's speed. Setting the `cancel` threading.Event ends the scan
+    at the next frame.
+    Returns:
+        ScanResult: code (None if nothing was read), confidence (share of
+        the reads that agree, scaled down below `votes_needed`), frames
+        examined and elapsed seconds.
+    """
+    camera = get_camera(camera_index)
+    decoders = get_decoders()
+    tracker = get_roi_tracker(camera_index)
+
+    start = time.monotonic()
+    last_timestamp = start
+    min_interval = 1.0 / max_fps
+    decode_time = 0.0
+    votes = Counter()
+    frames = 0
+    missed_frames = 0
+    empty_streak = 0
+
+    while time.monotonic() - start <= timeout_sec:
+        if cancel is not None and cancel.is_set():
+            break
+        frame, timestamp = camera.get_frame(newer_than=last_timestamp)
+        if frame is None:
+            print("Failed to read from camera.")
+            break
+        last_timestamp = timestamp
+        loop_start = time.monotonic()
+        frames += 1
+
+        # Cached and checked against the frame; picks up recalibration live
+        crop_box = get_crop_box(frame.shape)
+        regions = [crop_box]
+        tracked = tracker.roi(crop_box, frame.shape)
+        if tracked is not None and tracked != crop_box:
+            regions.insert(0, tracked)
+
+        decode_start = time.monotonic()
+        saw_code, read = False, None
+        for region in regions:
+            passed, read = _decode_region(decoders, frame, region, scale)
+            saw_code = saw_code or passed
+            if read is not None:
+                break
+        if read is None:
+            missed_frames += 1
+            if missed_frames % FULL_FRAME_EVERY == 0:
+                # The item may have landed off-centre; look everywhere. A code
+                # covers too little of the frame for the pre-check, so skip it
+                full = CropBox(0, 0, frame.shape[1], frame.shape[0])
+                _, read = _decode_region(decoders, frame, full, 1.0, precheck=False)
+        # Smoothed decoder cost, used to pace the loop
+        decode_time = 0.8 * decode_time + 0.2 * (time.monotonic() - decode_start)
+
+        if read is not None:
+            empty_streak = 0
+            tracker.observe(read.rect, crop_box)
+            votes[read.data] += 1
+            if votes[read.data] >= votes_needed:
+                break
+        elif saw_code:
+            empty_streak = 0
+        else:
+            empty_streak += 1
+            if not votes and empty_streak >= empty_stop_frames:
+                print(f"Scan area empty for {empty_streak} frames; stopping scan.")
+                break
+
+        # Don't process frames faster than the decoder can keep up with
+        wait = max(min_interval, decode_time) - (time.monotonic() - loop_start)
+        if wait > 0:
+            time.sleep(wait)
+
+    elapsed = time.monotonic() - start
+    if not votes:
+        print(f"No QR code read after {frames} frames ({elapsed:.2f}s).")
+        return ScanResult(None, 0.0, frames, elapsed)
+    code, count = votes.most_common(1)[0]
+    confidence = count / max(sum(votes.values()), votes_needed)
+    print(f"QR Code detected: {code} ({count} of {sum(votes.values())} reads)")
+    return ScanResult(code, confidence, frames, elapsed)
+
+def scan_qr_headless(camera_index=2, timeout_sec=5, scale=SCAN_SCALE, max_fps=SCAN_MAX_FPS):
+    """
+    First-read headless scan with the old contract.
+    Returns:
+        str: Decoded QR code data, or 'b4' if not found.
+    """
+    result = scan_qr_voting(camera_index, timeout_sec, votes_needed=1,
+                            empty_stop_frames=float('inf'), scale=scale, max_fps=max_fps)
+    return result.code if result.code else "b4"
+
+class QRPreview:
+    """
+    Optional alignment preview for the scan camera. Runs as its own consumer
+    of the shared camera, so scanning never waits on imshow/waitKey.
+    """
+
+    def __init__(self, camera_index=2, window_name="Live Camera (Box Area)"):
+        self.camera_index = camera_index
+        self.window_name = window_name
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._show_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _show_loop(self):
+        camera = get_camera(self.camera_index)
+        last_timestamp = None
+        while self._running:
+            frame, timestamp = camera.get_frame(newer_than=last_timestamp)
+            if frame is None:
+                continue
+            last_timestamp = timestamp
+            crop_x, crop_y, crop_width, crop_height = get_crop_box(frame.shape)
+            preview = frame.copy()
+            cv2.rectangle(
+                preview,
+                (crop_x, crop_y),
+                (crop_x + crop_width, crop_y + crop_height),
+                (0, 255, 0),
+                2,
+            )
+            cv2.imshow(self.window_name, preview)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+        cv2.destroyWindow(self.window_name)
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+BACKGROUND_FILE = "background.jpg"            # Manual snapshot from save_background_image.py
+SNAPSHOT_FILE = "background_model.png"        # Adapted reference written by the model
+BLUR_KSIZE = (5, 5)
+LEARNING_RATE = 0.05          # Weight of each confirmed-empty frame in the running average
+SNAPSHOT_INTERVAL_SEC = 600   # How often the adapted reference is written to disk
+
+def prepare_gray(img):
+    """Grayscale, blurred version of a BGR frame as used for background differencing."""
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.GaussianBlur(img, BLUR_KSIZE, 0)
+
+class BackgroundModel:
+    """
+    Keeps the empty-tray reference in memory as a grayscale, pre-blurred
+    image and adapts it with a running average whenever the caller has
+    confirmed the tray is empty, so slow lighting drift does not turn into
+    false detections. The adapted reference is saved only now and then.
+    """
+
+    def __init__(self, filename=BACKGROUND_FILE, snapshot_file=SNAPSHOT_FILE):
+        self.filename = filename
+        self.snapshot_file = snapshot_file
+        self._lock = threading.Lock()
+        self._average = None      # float32 running average
+        self._reference = None    # uint8 view handed to callers
+        self._last_snapshot = time.monotonic()
+        self._file_mtime = None   # mtime of background.jpg when loaded
+
+    def _manual_mtime(self):
+        try:
+            return os.path.getmtime(self.filename)
+        except OSError:
+            return None
+
+    def load(self):
+        """
+        Loads the reference from disk. The model's own snapshot is used if it
+        is newer than background.jpg, so a fresh manual capture always wins.
+        Returns False if no background image exists.
+        """
+        file_mtime = self._manual_mtime()
+        if os.path.exists(self.snapshot_file) and (
+            file_mtime is None or os.path.getmtime(self.snapshot_file) > file_mtime
+        ):
+            # Snapshots are stored already grayscale and blurred
+            reference = cv2.imread(self.snapshot_file, cv2.IMREAD_GRAYSCALE)
+        else:
+            img = cv2.imread(self.filename)
+            reference = prepare_gray(img) if img is not None else None
+        if reference is None:
+            return False
+        with self._lock:
+            self._reference = reference
+            self._average = reference.astype(np.float32)
+            self._file_mtime = file_mtime
+        return True
+
+    def reference(self):
+        """
+        Returns the blurred grayscale reference, or None if there is none.
+        A new manual capture of background.jpg replaces the adapted model.
+        """
+        with self._lock:
+            reference = self._reference
+            stale = self._file_mtime != self._manual_mtime()
+        if (reference is None or stale) and self.load():
+            with self._lock:
+                reference = self._reference
+        return reference
+
+    def update(self, frame_gray):
+        """
+        Blends a blurred grayscale frame of the empty tray into the reference.
+        Only call this once the tray is known to be empty.
+        """
+        with self._lock:
+            if self._average is None:
+                return
+            cv2.accumulateWeighted(frame_gray, self._average, LEARNING_RATE)
+            self._reference = cv2.convertScaleAbs(self._average)
+            reference = self._reference
+            save_due = time.monotonic() - self._last_snapshot >= SNAPSHOT_INTERVAL_SEC
+            if save_due:
+                self._last_snapshot = time.monotonic()
+        if save_due:
+            cv2.imwrite(self.snapshot_file, reference)
+            print(f"Background snapshot saved to {self.snapshot_file}")
+
+_model = None
+_model_lock = threading.Lock()
+
+def get_background_model():
+    """Returns the shared BackgroundModel, loading it on first use."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = BackgroundModel()
+            _model.load()
+        return _model
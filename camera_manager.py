@@ -0,0 +1,131 @@
+import atexit
+import threading
+import time
+import cv2
+
+# Consecutive failed reads before the device is considered dropped
+MAX_FAILED_READS = 10
+RECONNECT_DELAY_SEC = 1.0
+
+class CameraManager:
+    """
+    Keeps one camera device open and grabs frames on a background thread,
+    so callers always get the newest frame without paying for the
+    open/warm-up/release cycle on every request.
+    Use get_camera() instead of creating instances directly.
+    """
+
+    def __init__(self, camera_index):
+        self.camera_index = camera_index
+        self._cap = None
+        self._frame = None
+        self._timestamp = 0.0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._grab_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _open(self):
+        source_factory = _sources.get(self.camera_index, cv2.VideoCapture)
+        cap = source_factory(self.camera_index)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        # Keep the driver queue short so grabbed frames are always recent
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _grab_loop(self):
+        failed_reads = 0
+        while self._running:
+            if self._cap is None:
+                self._cap = self._open()
+                if self._cap is None:
+                    print(f"Camera {self.camera_index} not available. Retrying in {RECONNECT_DELAY_SEC} seconds...")
+                    time.sleep(RECONNECT_DELAY_SEC)
+                    continue
+                print(f"Camera {self.camera_index} opened.")
+                failed_reads = 0
+
+            ret, frame = self._cap.read()
+            if not ret:
+                failed_reads += 1
+                if failed_reads >= MAX_FAILED_READS:
+                    print(f"Camera {self.camera_index} dropped. Reconnecting...")
+                    self._cap.release()
+                    self._cap = None
+                    time.sleep(RECONNECT_DELAY_SEC)
+                continue
+
+            failed_reads = 0
+            with self._cond:
+                self._frame = frame
+                self._timestamp = time.monotonic()
+                self._cond.notify_all()
+
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def get_frame(self, newer_than=None, timeout=2.0):
+        """
+        Returns the newest frame and its time.monotonic() capture timestamp.
+        If `newer_than` is given, waits for a frame grabbed after that time.
+        Returns:
+            tuple: (frame, timestamp), or (None, None) on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._frame is None or (newer_than is not None and self._timestamp <= newer_than):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    return None, None
+                self._cond.wait(remaining)
+            return self._frame, self._timestamp
+
+_cameras = {}
+_cameras_lock = threading.Lock()
+# Replacement frame sources per device index (e.g. the simulator's synthetic cameras)
+_sources = {}
+
+def register_source(camera_index, factory):
+    """
+    Makes the manager for `camera_index` read from `factory(camera_index)`
+    instead of cv2.VideoCapture. The returned object needs isOpened(),
+    read(), set() and release(), like VideoCapture.
+    """
+    _sources[camera_index] = factory
+
+def get_camera(camera_index=0):
+    """Returns the shared, already started CameraManager for a device index."""
+    with _cameras_lock:
+        camera = _cameras.get(camera_index)
+        if camera is None:
+            camera = CameraManager(camera_index)
+            _cameras[camera_index] = camera
+        camera.start()
+        return camera
+
+def release_all():
+    with _cameras_lock:
+        cameras = list(_cameras.values())
+        _cameras.clear()
+    for camera in cameras:
+        camera.stop()
+
+atexit.register(release_all)
@@ -0,0 +1,69 @@
+import numpy as np
+from config_cache import get_cell_config
+
+DEFAULT_FRAME_SHAPE = (480, 640)
+
+class CellMap:
+    """
+    Tray calibration from tray_cells.json rasterized into an integer label
+    image: pixel value i+1 means cell i, 0 means outside every cell.
+    Cell lookups and per-cell pixel counts then become single array
+    operations, no matter how many cells the tray has.
+    """
+
+    def __init__(self, labels, rects, shape=DEFAULT_FRAME_SHAPE):
+        self.labels = list(labels)
+        self.rects = rects
+        # Dict form of the calibration, for drawing overlays
+        self.cells = [
+            {"label": label, "x": int(x), "y": int(y), "w": int(w), "h": int(h)}
+            for label, (x, y, w, h) in zip(self.labels, rects)
+        ]
+        self.shape = tuple(shape[:2])
+        self.label_image = np.zeros(self.shape, dtype=np.int32)
+        # Paint in reverse so the first matching rectangle wins on overlap,
+        # with inclusive right/bottom edges like the old per-cell check
+        for idx in range(len(self.labels) - 1, -1, -1):
+            x, y, w, h = (int(v) for v in rects[idx])
+            self.label_image[max(y, 0):y + h + 1, max(x, 0):x + w + 1] = idx + 1
+        # Index 0 maps to None so label ids can be used directly
+        self._label_lookup = np.array([None] + self.labels, dtype=object)
+        # Union of all cell rectangles, for watching only the tray itself
+        self.tray_mask = self.label_image > 0
+
+    def cell_ids(self, xs, ys):
+        """Returns label ids (0 = no cell) for arrays of pixel coordinates."""
+        xs = np.asarray(xs, dtype=np.intp)
+        ys = np.asarray(ys, dtype=np.intp)
+        inside = (xs >= 0) & (ys >= 0) & (xs < self.shape[1]) & (ys < self.shape[0])
+        ids = np.zeros(xs.shape, dtype=np.int32)
+        ids[inside] = self.label_image[ys[inside], xs[inside]]
+        return ids
+
+    def assign_many(self, xs, ys):
+        """Returns the cell label (or None) for every (x, y) centroid."""
+        return list(self._label_lookup[self.cell_ids(xs, ys)])
+
+    def assign(self, cx, cy):
+        return self.assign_many([cx], [cy])[0]
+
+    def occupancy(self, mask):
+        """Returns an array with the number of foreground pixels of `mask` in each cell."""
+        counts = np.bincount(self.label_image[mask > 0], minlength=len(self.labels) + 1)
+        return counts[1:]
+
+_cell_maps = {}
+
+def load_cell_map(filename="tray_cells.json", shape=DEFAULT_FRAME_SHAPE):
+    """
+    Returns a CellMap for the given frame shape. The rasterized map is built
+    once and reused until the calibration in the config cache changes.
+    """
+    shape = tuple(shape[:2])
+    config = get_cell_config(filename)
+    cached = _cell_maps.get((filename, shape))
+    if cached is not None and cached[0] is config:
+        return cached[1]
+    cell_map = CellMap(config.labels, config.rects, shape)
+    _cell_maps[(filename, shape)] = (config, cell_map)
+    return cell_map
@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+import numpy as np
+
+CELLS_FILE = "tray_cells.json"
+CROP_BOX_FILE = "crop_box.json"
+COUNT_FILE = "tray_counts.txt"
+TRAYS = ('B1', 'B2', 'B3', 'B4')
+
+# labels: tuple of cell labels, rects: read-only Nx4 int array of x, y, w, h
+CellConfig = namedtuple('CellConfig', ['labels', 'rects'])
+
+class CropBox(namedtuple('CropBox', ['x', 'y', 'width', 'height'])):
+    @property
+    def slices(self):
+        """(rows, cols) slices for cropping a frame: frame[box.slices]."""
+        return slice(self.y, self.y + self.height), slice(self.x, self.x + self.width)
+
+class CachedFile:
+    """
+    Parses a file once and hands out the same immutable result until the
+    file's mtime (or size) changes, so hot paths only pay for a stat().
+    Missing files raise FileNotFoundError as before.
+    """
+
+    def __init__(self, path, parser):
+        self.path = path
+        self.parser = parser
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._value = None
+
+    def get(self):
+        st = os.stat(self.path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stamp != self._stamp:
+                with open(self.path, "r") as f:
+                    self._value = self.parser(f)
+                self._stamp = stamp
+            return self._value
+
+def _parse_cells(f):
+    cells = json.load(f)
+    rects = np.array([[c["x"], c["y"], c["w"], c["h"]] for c in cells], dtype=np.int32).reshape(-1, 4)
+    rects.flags.writeable = False
+    return CellConfig(tuple(c["label"] for c in cells), rects)
+
+def _parse_crop_box(f):
+    data = json.load(f)
+    return CropBox(int(data["x"]), int(data["y"]), int(data["width"]), int(data["height"]))
+
+def _parse_counts(f):
+    counts = {tray: 0 for tray in TRAYS}
+    for line in f:
+        parts = line.strip().split()
+        if len(parts) == 3 and parts[0] in TRAYS:
+            counts[parts[0]] = int(parts[2])
+    return MappingProxyType(counts)
+
+_files = {}
+_files_lock = threading.Lock()
+
+def _cached(path, parser):
+    with _files_lock:
+        cached = _files.get(path)
+        if cached is None:
+            cached = CachedFile(path, parser)
+            _files[path] = cached
+        return cached
+
+def get_cell_config(path=CELLS_FILE):
+    return _cached(path, _parse_cells).get()
+
+def get_crop_box(frame_shape=None, path=CROP_BOX_FILE):
+    """
+    Returns the calibrated CropBox. With `frame_shape`, the box is clipped
+    to the frame, and a box that lies completely outside raises ValueError.
+    """
+    box = _cached(path, _parse_crop_box).get()
+    if frame_shape is None:
+        return box
+    frame_h, frame_w = frame_shape[:2]
+    x, y = max(box.x, 0), max(box.y, 0)
+    x2, y2 = min(box.x + box.width, frame_w), min(box.y + box.height, frame_h)
+    if x2 <= x or y2 <= y:
+        raise ValueError(f"Crop box {tuple(box)} is outside the {frame_w}x{frame_h} frame. Run qrcode_calibrate.py.")
+    if (x, y, x2 - x, y2 - y) != tuple(box):
+        return CropBox(x, y, x2 - x, y2 - y)
+    return box
+
+def get_tray_counts(path=COUNT_FILE):
+    """Returns a read-only tray -> count mapping; all zero if the file is missing."""
+    try:
+        return _cached(path, _parse_counts).get()
+    except FileNotFoundError:
+        return MappingProxyType({tray: 0 for tray in TRAYS})
+
+def write_json_atomic(path, data):
+    """
+    Writes JSON through a temporary file and os.replace(), so a running
+    controller never reads a half-written calibration file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,47 @@
+import json
+import queue
+import threading
+
+SUBSCRIBER_QUEUE_SIZE = 500   # Slow clients drop events beyond this
+
+class EventBus:
+    """
+    In-process publish/subscribe for dashboard updates. Each subscriber
+    gets its own bounded queue; every topic has a version number that
+    changes on each publish, which the JSON API uses as its ETag.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._versions = {}
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def version(self, topic):
+        with self._lock:
+            return self._versions.get(topic, 0)
+
+    def publish(self, topic, data):
+        with self._lock:
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait((topic, data))
+            except queue.Full:
+                pass  # Client is not keeping up; it resyncs from /api/state
+
+def format_sse(topic, data):
+    """Formats one Server-Sent Events message."""
+    return f"event: {topic}\ndata: {json.dumps(data)}\n\n"
+
+event_bus = EventBus()
@@ -0,0 +1,454 @@
+"""
+Hardware-in-the-loop simulator for the sorting cell.
+
+FakeArduino speaks the serial protocol of
+arduino_sketch/robot_arm_with_slider_final on a pseudo-terminal, with slider
+and servo timing modelled from the sketch. SyntheticCamera renders the tray
+(objects in tray_cells.json cells) and the scan station (a QR code in the
+crop_box.json region). controller_loop runs unmodified against both.
+
+Usage (Linux/macOS):
+    python hil_simulator.py --rounds 20 --speed 20
+"""
+import argparse
+import os
+import pty
+import random
+import select
+import shutil
+import sys
+import tempfile
+import termios
+import threading
+import time
+import tty
+import cv2
+import numpy as np
+import qrcode
+from slider_model import (
+    STEPS_PER_CM, HOMING_SPEED, CELL_SIZES_CM, SCANNING_AREA_CM, SORTED_AREA_START_CM, DWELL_SEC,
+    DEFAULT_PULSE, ARM_POSES, move_time, servo_move_time, sort_position_cm,
+)
+
+TRAY_CAMERA_INDEX = 0
+SCAN_CAMERA_INDEX = 2
+SIM_FPS = 30
+TRAY_CODES = ['b1', 'b2', 'b3', 'b4']
+
+BOOT_DELAY_SEC = 0.5         # Bootloader delay after the host opens the port (not scaled)
+PROMPT = "Enter slider position and robot arm action separated by space, e.g.: B c"
+
+class SimWorld:
+    """Shared state of the simulated cell: tray contents and the item in transit."""
+
+    def __init__(self, cells, items=6, seed=0, refill=True, miss_rate=0.0):
+        self.cells = cells
+        self.labels = [cell["label"] for cell in cells]
+        self.rng = random.Random(seed)
+        self.items = items
+        self.refill = refill
+        self.miss_rate = miss_rate
+        self.lock = threading.Lock()
+        self.tray = {}            # cell label -> tray code of the item in it
+        self.gripper = None
+        self.scan_station = None
+        self.sorted = []          # (true code, tray it was sorted into)
+        self.missed_picks = 0
+        self.empty_sorts = 0      # Sort motions with nothing in the gripper
+        self.rounds_completed = 0
+        self.rounds_aborted = 0
+        self.modeled_sec = 0.0    # Mechanical time at real speed
+        self._fill()
+
+    def _fill(self):
+        for label in self.rng.sample(self.labels, min(self.items, len(self.labels))):
+            self.tray[label] = self.rng.choice(TRAY_CODES)
+
+    def pick(self, label):
+        with self.lock:
+            if label in self.tray and self.rng.random() < self.miss_rate:
+                # The gripper closes next to the item and comes up empty
+                self.missed_picks += 1
+                self.gripper = None
+                return
+            self.gripper = self.tray.pop(label, None)
+
+    def refill_if_empty(self):
+        """The operator tops up an empty tray while the slider returns home."""
+        with self.lock:
+            if not self.tray and self.refill:
+                self._fill()
+
+    def drop_at_scan(self):
+        with self.lock:
+            self.scan_station, self.gripper = self.gripper, None
+
+    def pick_from_scan(self):
+        with self.lock:
+            self.gripper, self.scan_station = self.scan_station, None
+
+    def sort_into(self, tray_code):
+        with self.lock:
+            if self.gripper is not None:
+                self.sorted.append((self.gripper, tray_code))
+            else:
+                self.empty_sorts += 1
+            self.gripper = None
+
+class FakeArduino:
+    """
+    Emulates robot_arm_with_slider_final.ino on a pseudo-terminal. Open
+    `port_name` with pyserial as if it were the board. All motion times are
+    divided by `speed` so rounds run faster than real time.
+    """
+
+    def __init__(self, world, speed=1.0):
+        self.world = world
+        self.speed = speed
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)
+        self.port_name = os.ttyname(self.slave_fd)
+        self.position_steps = 0
+        self.current_pulse = list(DEFAULT_PULSE)
+        self.round_counts = {code: 0 for code in TRAY_CODES}
+        self._buffer = b""
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    # --- Serial helpers ---
+    def println(self, text):
+        os.write(self.master_fd, (text + "\r\n").encode())
+
+    def read_line(self):
+        """Blocks until a full line arrives (Serial.readStringUntil('\\n'))."""
+        while self._running:
+            if b"\n" in self._buffer:
+                line, self._buffer = self._buffer.split(b"\n", 1)
+                return line.decode(errors="replace").strip()
+            ready, _, _ = select.select([self.master_fd], [], [], 0.1)
+            if ready:
+                try:
+                    self._buffer += os.read(self.master_fd, 1024)
+                except OSError:
+                    time.sleep(0.1)
+        return None
+
+    def wait(self, seconds):
+        self.world.modeled_sec += seconds
+        time.sleep(seconds / self.speed)
+
+    # --- Motion, as in the sketch ---
+    def move_to_position(self, cm):
+        target = cm * STEPS_PER_CM
+        self.wait(move_time(target - self.position_steps))
+        self.position_steps = target
+        self.println(f"Arrived at {cm} cm.")
+
+    def home_stepper(self):
+        self.println("Homing slider...")
+        self.wait(self.position_steps / HOMING_SPEED)
+        self.position_steps = 0
+        self.println("Slider homed to position 0cm.")
+
+    def move_servos(self, to_pulses):
+        self.wait(servo_move_time(self.current_pulse, to_pulses))
+        self.current_pulse = list(to_pulses)
+
+    def robotarm(self, pose, return_home=True):
+        upper, target, target_close, upper_close = ARM_POSES[pose]
+        for pulses in (upper, target, target_close, upper_close):
+            self.move_servos(pulses)
+            self.wait(DWELL_SEC)
+        if return_home:
+            self.move_servos(DEFAULT_PULSE)
+            self.wait(DWELL_SEC)
+
+    def dispatch_function(self, ch, column):
+        if ch in ('a', 'b', 'c'):
+            self.robotarm(ch)
+            self.world.pick(f"{column} {ch}")
+        else:
+            self.println("Unknown robot arm command.")
+
+    def trigger_sort_function(self, code):
+        if code not in SORTED_AREA_START_CM:
+            return
+        count = self.round_counts[code]
+        cm = sort_position_cm(code, count)
+        self.println(f"Moving slider to sorted area for {code} ({cm} cm)")
+        self.move_to_position(cm)
+        self.println(f"Triggered {code}()")
+        family = 'b13' if code in ('b1', 'b3') else 'b24'
+        self.robotarm(f"{family}_{'odd' if count % 2 == 1 else 'even'}")
+        self.world.sort_into(code)
+        self.round_counts[code] += 1
+
+    def wait_for_host_open(self):
+        """
+        The real board resets when the host opens the port, and pyserial
+        flushes the input buffer on open, so nothing may be printed before
+        that. Opening shows up as the port being configured to 9600 baud.
+        """
+        while self._running and termios.tcgetattr(self.slave_fd)[5] != termios.B9600:
+            time.sleep(0.02)
+        time.sleep(BOOT_DELAY_SEC)
+
+    # --- setup() and loop() ---
+    def _run(self):
+        self.wait_for_host_open()
+        self.home_stepper()
+        self.println(PROMPT)
+        while self._running:
+            line = self.read_line()
+            if line is None:
+                break
+            if line == 'PING':
+                self.println("READY")
+                self.println(PROMPT)
+                continue
+            space = line.find(' ')
+            slider_input = line[:space] if space >= 0 else line
+            robot_input = line[space + 1:] if space >= 0 else line
+            last_space = line.rfind(' ')
+            last_token = line[last_space + 1:]
+            direct_tray = ""
+            if last_space > space and len(last_token) == 2 and last_token[0] == 'b' and last_token[1].isdigit():
+                direct_tray = last_token
+            cell_index = ord(slider_input[0]) - ord('A') if slider_input else 0
+            cell_cm = CELL_SIZES_CM[cell_index] if 0 <= cell_index < len(CELL_SIZES_CM) else 0
+
+            self.println(f"Moving slider to cell {slider_input} at {cell_cm} cm")
+            self.move_to_position(cell_cm)
+            self.println(f"Triggering robot arm function: {robot_input}")
+            self.dispatch_function(robot_input[:1], slider_input[:1])
+
+            if direct_tray:
+                self.println(f"Sorting directly to {direct_tray}")
+                self.trigger_sort_function(direct_tray)
+                self.finish_round()
+                continue
+
+            self.println(f"Moving slider to scanning area ({SCANNING_AREA_CM} cm)")
+            self.move_to_position(SCANNING_AREA_CM)
+            self.println("Triggering scanningdrop()")
+            self.robotarm('scanningdrop', return_home=False)
+            self.world.drop_at_scan()
+            self.println("READY_TO_SCAN")
+            self.println("Enter sorted area action (b1, b2, b3):")
+
+            sort_input = self.read_line()
+            while sort_input == 'PING':
+                self.println("READY SORT")
+                sort_input = self.read_line()
+            if sort_input is None:
+                break
+            if sort_input == 'x':
+                self.println("Pick missed, skipping sort")
+                self.move_servos(DEFAULT_PULSE)
+                self.wait(DWELL_SEC)
+                self.finish_round(aborted=True)
+                continue
+            self.println("Triggering scanningpick()")
+            self.robotarm('scanningpick')
+            self.world.pick_from_scan()
+            self.trigger_sort_function(sort_input)
+            self.finish_round()
+
+    def finish_round(self, aborted=False):
+        self.println("ROUND_ABORTED" if aborted else "ROUND_COMPLETE")
+        with self.world.lock:
+            if aborted:
+                self.world.rounds_aborted += 1
+            else:
+                self.world.rounds_completed += 1
+        self.println("Returning slider to home position...")
+        self.home_stepper()
+        self.world.refill_if_empty()
+        self.println(PROMPT)
+
+class SyntheticCamera:
+    """
+    VideoCapture-like frame source for camera_manager.register_source().
+    The tray view draws an object in every occupied cell on top of
+    background.jpg; the scan view shows the item's QR code in the crop box,
+    shifted by `scan_offset` pixels to mimic items landing off-centre.
+    With `show_codes`, tray items carry their QR code on top as well.
+    """
+
+    def __init__(self, world, view, background_file="background.jpg", crop_box=None, scan_offset=(0, 0),
+                 show_codes=False):
+        self.world = world
+        self.view = view
+        if view == 'tray':
+            self.base = cv2.imread(background_file)
+        else:
+            rng = np.random.default_rng(1)
+            self.base = rng.normal(110, 4, (480, 640, 3)).clip(0, 255).astype(np.uint8)
+        self.crop_box = crop_box
+        self.scan_offset = scan_offset
+        self.show_codes = show_codes
+        self._qr_cache = {}
+        self._last_read = 0.0
+
+    def isOpened(self):
+        return self.base is not None
+
+    def set(self, prop, value):
+        return True
+
+    def release(self):
+        pass
+
+    def _qr_image(self, code, size):
+        key = (code, size)
+        if key not in self._qr_cache:
+            img = np.array(qrcode.make(code, border=2).convert("L"), dtype=np.uint8)
+            img = cv2.resize(img, (size, size), interpolation=cv2.INTER_NEAREST)
+            self._qr_cache[key] = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        return self._qr_cache[key]
+
+    def read(self):
+        # Pace like a real camera
+        wait = self._last_read + 1.0 / SIM_FPS - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_read = time.monotonic()
+
+        frame = self.base.copy()
+        with self.world.lock:
+            occupied = dict(self.world.tray)
+            at_scan = self.world.scan_station
+        if self.view == 'tray':
+            for cell in self.world.cells:
+                if cell["label"] in occupied:
+                    center = (cell["x"] + cell["w"] // 2, cell["y"] + cell["h"] // 2)
+                    radius = int(min(cell["w"], cell["h"]) * 0.3)
+                    # Dark item on a light cell and vice versa, so it differs from the background
+                    cell_gray = cv2.cvtColor(self.base[cell["y"]:cell["y"] + cell["h"], cell["x"]:cell["x"] + cell["w"]], cv2.COLOR_BGR2GRAY)
+                    color = (30, 40, 120) if cell_gray.mean() > 110 else (170, 200, 235)
+                    cv2.circle(frame, center, radius, color, -1)
+                    if self.show_codes:
+                        size = int(min(cell["w"], cell["h"]) * 0.6)
+                        ox, oy = center[0] - size // 2, center[1] - size // 2
+                        frame[oy:oy + size, ox:ox + size] = self._qr_image(occupied[cell["label"]], size)
+        elif at_scan is not None:
+            x, y, w, h = self.crop_box
+            size = int(min(w, h) * 0.8)
+            qr = self._qr_image(at_scan, size)
+            fh, fw = frame.shape[:2]
+            ox = min(max(x + (w - size) // 2 + self.scan_offset[0], 0), fw - size)
+            oy = min(max(y + (h - size) // 2 + self.scan_offset[1], 0), fh - size)
+            frame[oy:oy + size, ox:ox + size] = qr
+        return True, frame
+
+def run_benchmark(rounds=10, speed=20.0, items=6, seed=0, scan_offset=(0, 0), tray_codes=False, miss_rate=0.0,
+                  timeout_sec=3600):
+    """
+    Runs controller_loop against the simulator in a scratch directory and
+    returns a dict with timing results.
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    work_dir = tempfile.mkdtemp(prefix="sorting_sim_")
+    for name in ("tray_cells.json", "crop_box.json", "background.jpg"):
+        shutil.copy(os.path.join(repo_dir, name), work_dir)
+    shutil.copytree(os.path.join(repo_dir, "templates"), os.path.join(work_dir, "templates"))
+    os.chdir(work_dir)
+    sys.path.insert(0, repo_dir)
+
+    # Imported after chdir so the controller's log and database live in work_dir
+    import camera_manager
+    import serial_link
+    from config_cache import get_cell_config, get_crop_box
+    import main_controller2
+
+    config = get_cell_config()
+    cells = [
+        {"label": label, "x": int(x), "y": int(y), "w": int(w), "h": int(h)}
+        for label, (x, y, w, h) in zip(config.labels, config.rects)
+    ]
+    world = SimWorld(cells, items=items, seed=seed, miss_rate=miss_rate)
+    crop_box = tuple(get_crop_box())
+    camera_manager.register_source(TRAY_CAMERA_INDEX, lambda index: SyntheticCamera(world, 'tray', show_codes=tray_codes))
+    camera_manager.register_source(SCAN_CAMERA_INDEX, lambda index: SyntheticCamera(world, 'scan', crop_box=crop_box, scan_offset=scan_offset))
+
+    arduino = FakeArduino(world, speed=speed)
+    arduino.start()
+
+    main_controller2.set_status('running')
+    controller = threading.Thread(
+        target=main_controller2.controller_loop,
+        kwargs={'serial_port': arduino.port_name, 'camera_index': SCAN_CAMERA_INDEX},
+        daemon=True,
+    )
+    start = time.monotonic()
+    controller.start()
+
+    while time.monotonic() - start < timeout_sec and controller.is_alive():
+        with world.lock:
+            done = world.rounds_completed
+        if done >= rounds:
+            break
+        # Act as the operator: empty the sort trays before the controller stops on a full tray
+        if any(count >= 3 for count in main_controller2.read_counts().values()):
+            main_controller2.get_round_store().reset()
+        time.sleep(0.05)
+
+    wall_sec = time.monotonic() - start
+    main_controller2.set_status('stopped')
+    controller.join(timeout=5)
+    serial_link.close_all()
+    arduino.stop()
+    camera_manager.release_all()
+
+    with world.lock:
+        done = world.rounds_completed
+        modeled_sec = world.modeled_sec
+        correct = sum(1 for code, tray in world.sorted if code == tray)
+        missed, aborted, empty_sorts = world.missed_picks, world.rounds_aborted, world.empty_sorts
+    # Mechanical time ran `speed` times faster; put it back at real speed
+    projected_sec = wall_sec - modeled_sec / speed + modeled_sec
+    return {
+        'rounds': done,
+        'wall_sec': round(wall_sec, 2),
+        'modeled_motion_sec': round(modeled_sec, 2),
+        'projected_real_sec': round(projected_sec, 2),
+        'projected_rounds_per_hour': round(3600 * done / projected_sec, 1) if done else 0.0,
+        'correctly_sorted': correct,
+        'missed_picks': missed,
+        'aborted_rounds': aborted,
+        'empty_sorts': empty_sorts,
+        'work_dir': work_dir,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the controller against a simulated Arduino and cameras.")
+    parser.add_argument("--rounds", type=int, default=10, help="Rounds to run")
+    parser.add_argument("--speed", type=float, default=20.0, help="Motion speed-up factor")
+    parser.add_argument("--items", type=int, default=6, help="Items placed in the tray per refill")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scan-offset", type=int, nargs=2, default=(0, 0), metavar=("DX", "DY"),
+                        help="Shift the QR code at the scan station by this many pixels")
+    parser.add_argument("--tray-codes", action="store_true", help="Show the items' QR codes to the tray camera too")
+    parser.add_argument("--miss-rate", type=float, default=0.0, help="Probability that a pick comes up empty")
+    args = parser.parse_args()
+
+    result = run_benchmark(rounds=args.rounds, speed=args.speed, items=args.items, seed=args.seed,
+                           scan_offset=tuple(args.scan_offset), tray_codes=args.tray_codes, miss_rate=args.miss_rate)
+    print("\nSimulation results:")
+    for key, value in result.items():
+        print(f"  {key}: {value}")
+
+if __name__ == "__main__":
+    main()
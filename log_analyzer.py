@@ -0,0 +1,289 @@
+"""
+Cycle-time analyzer for system.log.
+
+Reads one or more logs (rotated files in order, .gz allowed, '-' for stdin)
+in a single streaming pass, rebuilds each round's timeline from the
+messages log_message writes and reports throughput, phase durations, QR
+fallbacks to b4, missed picks, idle gaps and how the pick scheduler's
+expected round times compare with the measured ones.
+
+Durations need the timestamps log_message writes; older lines without one
+still count towards rounds and fallbacks.
+
+Usage:
+    python log_analyzer.py system.log.2.gz system.log.1 system.log
+    python log_analyzer.py --json report.json system.log
+"""
+import argparse
+import gzip
+import json
+import sys
+import time
+import numpy as np
+from log_writer import parse_line
+
+PHASES = ('wait_prompt', 'detection', 'motion', 'scan', 'sort', 'pick_and_sort', 'round')
+IDLE_GAP_SEC = 60       # Silence longer than this between log lines counts as idle
+TOP_GAPS = 5
+
+# (phase, start mark, end mark) computed for every completed round
+PHASE_MARKS = (
+    ('wait_prompt', 'waiting', 'prompt'),
+    ('detection', 'prompt', 'cell_sent'),
+    ('motion', 'cell_sent', 'ready_to_scan'),
+    ('scan', 'ready_to_scan', 'tray_sent'),
+    ('sort', 'tray_sent', 'complete'),
+    ('pick_and_sort', 'cell_and_tray_sent', 'complete'),
+    ('round', 'prompt', 'complete'),
+)
+
+def classify(msg):
+    """Maps a log message to a timeline mark (or None)."""
+    if msg.startswith("Waiting for Arduino to request slider/arm input"):
+        return 'waiting'
+    if msg.startswith("Arduino: Enter slider position"):
+        return 'prompt'
+    if msg == "Sent to Arduino: x":
+        return 'abort_sent'
+    if msg.startswith("Sent to Arduino: "):
+        # "C a" is the column and arm ("C a a" in older logs), a trailing
+        # "b2" is the tray code read by the tray camera, and a single token
+        # is the tray code from the scan
+        tokens = msg.split()
+        if len(tokens) > 5 and tokens[-1][:1] == 'b' and tokens[-1][1:].isdigit():
+            return 'cell_and_tray_sent'
+        return 'cell_sent' if len(tokens) > 4 else 'tray_sent'
+    if msg == "Arduino: READY_TO_SCAN":
+        return 'ready_to_scan'
+    if msg == "Arduino: ROUND_COMPLETE":
+        return 'complete'
+    if msg == "Arduino: ROUND_ABORTED":
+        return 'aborted'
+    if msg.startswith("Expected round time: "):
+        return 'expected'
+    if msg.startswith("Pick missed"):
+        return 'pick_missed'
+    if msg.startswith("No object detected in tray"):
+        return 'retry'
+    if msg.startswith("QR scan result: ") or msg.startswith("Detected tray code: "):
+        return 'qr_result'
+    if msg.startswith("No valid QR code detected") or msg.startswith("QR scan error"):
+        return 'qr_fallback'
+    if msg.startswith("Connected to Arduino") or msg.startswith("System stopped") or msg.startswith("System paused"):
+        return 'session'
+    return None
+
+def read_lines(paths):
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+        elif path.endswith('.gz'):
+            with gzip.open(path, 'rt', errors='replace') as f:
+                yield from f
+        else:
+            with open(path, 'r', errors='replace') as f:
+                yield from f
+
+class CycleAnalyzer:
+    """
+    Consumes log lines one at a time. Only the current round's marks are
+    kept; finished rounds are reduced to their phase durations.
+    """
+
+    def __init__(self, idle_gap_sec=IDLE_GAP_SEC):
+        self.idle_gap_sec = idle_gap_sec
+        self.rounds = 0
+        self.timed_rounds = 0
+        self.retries = 0
+        self.fallbacks = 0
+        self.qr_scans = 0
+        self.direct_rounds = 0
+        self.missed_picks = 0
+        self.aborted_rounds = 0
+        self.lines = 0
+        self.untimed_lines = 0
+        self.durations = {phase: [] for phase in PHASES}
+        self.idle_gaps = []        # (start, seconds)
+        self.round_estimates = []  # (expected, measured) seconds from sending the cell to ROUND_COMPLETE
+        self.first_time = None
+        self.last_time = None
+        self._marks = {}
+        self._fallback = False
+        self._structured = False
+
+    def feed(self, line):
+        timestamp, msg = parse_line(line)
+        msg = msg.strip()
+        if not msg:
+            return
+        self.lines += 1
+        if timestamp is None:
+            self.untimed_lines += 1
+        else:
+            if self.last_time is not None and timestamp - self.last_time > self.idle_gap_sec:
+                self.idle_gaps.append((self.last_time, timestamp - self.last_time))
+            if self.first_time is None:
+                self.first_time = timestamp
+            self.last_time = timestamp
+
+        mark = classify(msg)
+        if mark is None:
+            return
+        if mark == 'retry':
+            self.retries += 1
+        elif mark == 'pick_missed':
+            self.missed_picks += 1
+        elif mark == 'expected':
+            try:
+                self._marks['expected'] = float(msg.split()[-1].rstrip('s'))
+            except ValueError:
+                pass
+        elif mark == 'aborted':
+            # A missed pick skipped the scan and sort; not a sorting round
+            self.aborted_rounds += 1
+            self._marks = {}
+        elif mark == 'qr_result':
+            # Older scanners returned 'b4' when nothing was decoded; voting
+            # scans log "(confidence ...)" and an explicit fallback line
+            if "(confidence" in msg:
+                self._structured = True
+            elif msg.endswith(" b4") and not self._structured:
+                self._fallback = True
+        elif mark == 'qr_fallback':
+            self._fallback = True
+        elif mark == 'session':
+            # A stop or pause breaks the current round's timeline
+            self._marks = {}
+            self._fallback = False
+        elif mark == 'waiting':
+            self._marks = {'waiting': timestamp}
+            self._fallback = False
+            self._structured = False
+        else:
+            self._marks.setdefault(mark, timestamp)
+            if mark == 'cell_and_tray_sent':
+                self._marks.setdefault('cell_sent', timestamp)
+            elif mark == 'tray_sent':
+                self.qr_scans += 1
+                self.fallbacks += self._fallback
+            elif mark == 'complete':
+                self._finish_round()
+
+    def _finish_round(self):
+        self.rounds += 1
+        marks, self._marks = self._marks, {}
+        if 'cell_and_tray_sent' in marks:
+            self.direct_rounds += 1
+        timed = False
+        for phase, start, end in PHASE_MARKS:
+            if marks.get(start) is not None and marks.get(end) is not None:
+                self.durations[phase].append(marks[end] - marks[start])
+                timed = True
+        self.timed_rounds += timed
+        sent = marks.get('cell_sent')
+        if marks.get('expected') is not None and sent is not None and marks.get('complete') is not None:
+            self.round_estimates.append((marks['expected'], marks['complete'] - sent))
+
+    def report(self):
+        span_sec = (self.last_time - self.first_time) if self.first_time is not None else 0.0
+        idle_sec = sum(seconds for _, seconds in self.idle_gaps)
+        active_sec = span_sec - idle_sec
+        phases = {}
+        for phase, values in self.durations.items():
+            if not values:
+                continue
+            arr = np.array(values)
+            phases[phase] = {
+                'count': len(values),
+                'mean_sec': round(float(arr.mean()), 3),
+                'p50_sec': round(float(np.percentile(arr, 50)), 3),
+                'p90_sec': round(float(np.percentile(arr, 90)), 3),
+                'p99_sec': round(float(np.percentile(arr, 99)), 3),
+                'max_sec': round(float(arr.max()), 3),
+            }
+        estimates = None
+        if self.round_estimates:
+            expected, measured = np.array(self.round_estimates).T
+            estimates = {
+                'count': len(self.round_estimates),
+                'mean_expected_sec': round(float(expected.mean()), 3),
+                'mean_measured_sec': round(float(measured.mean()), 3),
+                'mean_error_sec': round(float((measured - expected).mean()), 3),
+            }
+        longest = sorted(self.idle_gaps, key=lambda gap: gap[1], reverse=True)[:TOP_GAPS]
+        return {
+            'lines': self.lines,
+            'untimed_lines': self.untimed_lines,
+            'rounds': self.rounds,
+            'timed_rounds': self.timed_rounds,
+            'detection_retries': self.retries,
+            'direct_rounds': self.direct_rounds,
+            'missed_picks': self.missed_picks,
+            'aborted_rounds': self.aborted_rounds,
+            'qr_scans': self.qr_scans,
+            'qr_fallbacks': self.fallbacks,
+            'qr_fallback_rate': round(self.fallbacks / self.qr_scans, 3) if self.qr_scans else None,
+            'span_sec': round(span_sec, 1),
+            'active_sec': round(active_sec, 1),
+            'rounds_per_hour': round(3600 * self.timed_rounds / span_sec, 1) if span_sec > 0 else None,
+            'active_rounds_per_hour': round(3600 * self.timed_rounds / active_sec, 1) if active_sec > 0 else None,
+            'phases': phases,
+            'round_estimates': estimates,
+            'idle_gaps': {
+                'threshold_sec': self.idle_gap_sec,
+                'count': len(self.idle_gaps),
+                'total_sec': round(idle_sec, 1),
+                'longest': [
+                    {'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start)), 'seconds': round(seconds, 1)}
+                    for start, seconds in longest
+                ],
+            },
+        }
+
+def print_report(report):
+    print(f"Lines: {report['lines']} ({report['untimed_lines']} without timestamp)")
+    print(f"Rounds: {report['rounds']} ({report['timed_rounds']} with timing)")
+    print(f"Detection retries: {report['detection_retries']}")
+    if report['direct_rounds']:
+        print(f"Rounds that skipped the scan station: {report['direct_rounds']}")
+    if report['missed_picks']:
+        print(f"Missed picks: {report['missed_picks']} ({report['aborted_rounds']} rounds aborted before the scan)")
+    if report['qr_scans']:
+        print(f"QR fallbacks to b4: {report['qr_fallbacks']}/{report['qr_scans']} ({report['qr_fallback_rate']:.1%})")
+    if report['rounds_per_hour'] is not None:
+        print(f"Throughput: {report['rounds_per_hour']} rounds/h overall, "
+              f"{report['active_rounds_per_hour']} rounds/h excluding idle gaps")
+    if report['phases']:
+        print(f"\n{'phase':14s} {'count':>6s} {'mean':>8s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s}")
+        for phase, stats in report['phases'].items():
+            print(f"{phase:14s} {stats['count']:6d} {stats['mean_sec']:8.2f} {stats['p50_sec']:8.2f} "
+                  f"{stats['p90_sec']:8.2f} {stats['p99_sec']:8.2f} {stats['max_sec']:8.2f}")
+    estimates = report['round_estimates']
+    if estimates:
+        print(f"\nExpected vs measured round (cell sent to complete, {estimates['count']} rounds): "
+              f"{estimates['mean_expected_sec']:.2f}s vs {estimates['mean_measured_sec']:.2f}s "
+              f"(mean error {estimates['mean_error_sec']:+.2f}s)")
+    gaps = report['idle_gaps']
+    if gaps['count']:
+        print(f"\nIdle gaps over {gaps['threshold_sec']}s: {gaps['count']}, {gaps['total_sec']}s total")
+        for gap in gaps['longest']:
+            print(f"  {gap['start']}  {gap['seconds']}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild round timelines from system.log and report cycle times.")
+    parser.add_argument("logs", nargs="*", default=["system.log"], help="Log files in chronological order ('-' for stdin)")
+    parser.add_argument("--idle-gap", type=float, default=IDLE_GAP_SEC, help="Seconds of silence counted as idle")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    analyzer = CycleAnalyzer(idle_gap_sec=args.idle_gap)
+    for line in read_lines(args.logs):
+        analyzer.feed(line)
+    report = analyzer.report()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+TAIL_SIZE = 30          # Lines kept in memory for the dashboard
+BATCH_SIZE = 200        # Max lines written per flush
+
+_TRUNCATE = object()    # Queue marker: empty the log file
+
+# Compact ISO 8601 basic-format prefix with milliseconds, e.g. 20251018T142501.372
+TIMESTAMP_LENGTH = 19
+
+def format_line(msg, timestamp=None):
+    """Prefixes a log message with its local time."""
+    if timestamp is None:
+        timestamp = time.time()
+    millis = int(timestamp * 1000) % 1000
+    return f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(timestamp))}.{millis:03d} {msg}"
+
+def parse_line(line):
+    """
+    Splits a log line into (timestamp, message). Lines written before
+    timestamps were added give (None, line).
+    """
+    line = line.rstrip('\n')
+    stamp = line[:TIMESTAMP_LENGTH]
+    if len(line) > TIMESTAMP_LENGTH and line[TIMESTAMP_LENGTH] == ' ' and stamp[8:9] == 'T' and stamp[15:16] == '.':
+        try:
+            return _parse_second(stamp[:15]) + int(stamp[16:]) / 1000, line[TIMESTAMP_LENGTH + 1:]
+        except ValueError:
+            pass
+    return None, line
+
+_last_second = (None, None)
+
+def _parse_second(stamp):
+    # Consecutive lines mostly share a second, so skip strptime for repeats
+    global _last_second
+    if _last_second[0] != stamp:
+        _last_second = (stamp, time.mktime(time.strptime(stamp, '%Y%m%dT%H%M%S')))
+    return _last_second[1]
+
+class AsyncLogWriter:
+    """
+    Appends log lines to a file from a background thread. Callers only
+    enqueue; the writer keeps the file open and flushes in batches. The
+    last TAIL_SIZE lines are kept in a ring buffer so the dashboard can
+    show them without touching the disk.
+    """
+
+    def __init__(self, path, tail_size=TAIL_SIZE):
+        self.path = path
+        self._queue = queue.Queue()
+        self._tail = deque(maxlen=tail_size)
+        self._tail_lock = threading.Lock()
+        self._load_tail()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _load_tail(self):
+        # One-time read so the dashboard shows history after a restart
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self._tail.extend(line.rstrip('\n') for line in f)
+
+    def write(self, line):
+        with self._tail_lock:
+            self._tail.append(line)
+        self._queue.put(line)
+
+    def tail(self):
+        with self._tail_lock:
+            return list(self._tail)
+
+    def clear(self):
+        """Empties the ring buffer and truncates the file (on the writer thread)."""
+        with self._tail_lock:
+            self._tail.clear()
+        self._queue.put(_TRUNCATE)
+
+    def flush(self):
+        """Blocks until everything queued so far is on disk."""
+        self._queue.join()
+
+    def _write_loop(self):
+        f = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if f is None:
+                    f = open(self.path, 'a')
+                lines = []
+                for item in batch:
+                    if item is _TRUNCATE:
+                        lines = []  # Queued before the clear, so discard
+                        f.seek(0)
+                        f.truncate()
+                    else:
+                        lines.append(item)
+                if lines:
+                    f.write('\n'.join(lines) + '\n')
+                f.flush()
+            except OSError as e:
+                # Disk full or no permission: drop this batch but keep serving, so flush() never hangs
+                print(f"Log write error on {self.path}: {e}")
+                if f is not None:
+                    try:
+                        f.close()
+                    except OSError:
+                        pass
+                    f = None
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_log_writer(path):
+    """Returns the shared AsyncLogWriter for a log file."""
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = AsyncLogWriter(path)
+            _writers[path] = writer
+        return writer
+
+def _flush_all():
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        # A dead writer thread would never drain its queue
+        if writer.is_alive():
+            writer.flush()
+
+atexit.register(_flush_all)
@@ -4,8 +4,8 @@ import serial
 from flask import Flask, render_template, redirect, url_for, request
 import os
 from automated_tray_sorting import scan_qr_live_cropped_timeout
-from automated_cell_selection import select_random_cell_and_format
-import random
+from automated_cell_selection import select_cell_and_format, choose_arm
+from log_writer import format_line
 
 app = Flask(__name__)
 COUNT_FILE = 'tray_counts.txt'
@@ -19,7 +19,7 @@ controller_thread = None
 def log_message(msg):
     print(msg)
     with open(LOG_FILE, 'a') as f:
-        f.write(msg + '\n')
+        f.write(format_line(msg) + '\n')
 
 def read_counts():
     counts = {tray: 0 for tray in TRAYS}
@@ -90,7 +90,7 @@ def controller_loop(serial_port='COM6', baud_rate=9600, camera_index=2):
             continue
 
         # Automated cell selection, check for empty tray
-        cell_label = select_random_cell_and_format()
+        cell_label = select_cell_and_format()
         retry_count = 0
         while cell_label is None:
             log_message("No object detected in tray. Retrying in 10 seconds...")
@@ -98,7 +98,7 @@ def controller_loop(serial_port='COM6', baud_rate=9600, camera_index=2):
                 if run_state['status'] != 'running':
                     break
                 time.sleep(1)
-            cell_label = select_random_cell_and_format()
+            cell_label = select_cell_and_format()
             retry_count += 1
             if retry_count >= 12:
                 log_message("No object detected after multiple retries. System stopped.")
@@ -107,11 +107,10 @@ def controller_loop(serial_port='COM6', baud_rate=9600, camera_index=2):
         if run_state['status'] != 'running':
             continue
 
-        # Random arm action
-        arm_actions = ['a', 'b', 'c', 'd']
-        arm = random.choice(arm_actions)
+        # The arm action is the cell's row letter
+        arm = choose_arm(cell_label)
         log_message(f"Automated selection: Slider cell '{cell_label}', Arm '{arm}'")
-        user_input = f"{cell_label} {arm}"
+        user_input = f"{cell_label.split()[0]} {arm}"
 
         # Send slider/arm input to Arduino
         ser.write((user_input + '\n').encode())
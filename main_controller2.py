@@ -1,248 +1,586 @@
+import asyncio
 import threading
 import time
-import serial
-from flask import Flask, render_template, redirect, url_for, request
-import os
-from automated_tray_sorting import scan_qr_live_cropped_timeout
-from automated_cell_selection import select_random_cell_and_format
-import random
+import queue
+import traceback
+from flask import Flask, render_template, redirect, url_for, request, jsonify, Response
+from automated_tray_sorting import scan_qr_voting
+from automated_cell_selection import (
+    capture_tray_frame, plan_pick, choose_arm, capture_tray_reference, verify_pick, wait_for_tray_change,
+    NextCellPrefetcher,
+)
+from log_writer import get_log_writer, format_line
+from round_store import get_round_store
+from slider_model import round_time
+from serial_link import get_link, SerialLinkLost
+from event_bus import event_bus, format_sse
+import metrics
+from metrics import PHASE_SECONDS, ROUNDS, PICKS, DETECTION_RETRIES, QR_FALLBACKS, SERIAL_ERRORS
+from serial_events import (
+    LoopQueue, RoundStateMachine, SERIAL_ERROR, arrived_cm,
+    WAITING_FOR_PROMPT, SELECTING_CELL, WAITING_FOR_SCAN, SCANNING,
+    WAITING_FOR_COMPLETE, ROUND_DONE,
+)
 
 app = Flask(__name__)
-COUNT_FILE = 'tray_counts.txt'
 LOG_FILE = 'system.log'
 TRAYS = ['B1', 'B2', 'B3', 'B4']
+# Voting scans at or below this confidence are routed like a missed read. A single
+# read at timeout and a tie between two codes both score exactly 0.5
+QR_MIN_CONFIDENCE = 0.5
+# Stop when the tray stays empty this long; until then the tray camera watches for a refill
+EMPTY_TRAY_TIMEOUT_SEC = 120
+# Select the next round's cell while the arm is still busy with the current one
+PIPELINED_DETECTION = True
+# Slider position (cm) at which the arm is clear of the tray cells (scanning area in the sketch)
+TRAY_CLEAR_CM = 38
+# Read the items' QR codes with the tray camera and skip the scan station when one was read
+OVERHEAD_QR = True
+# Consecutive missed picks after which a cell is skipped until the tray changes
+MAX_PICK_MISSES = 3
 
 run_state = {'status': 'stopped'}  # can be 'stopped', 'running', 'paused'
-tray_counts = {tray: 0 for tray in TRAYS}
-controller_thread = None
+_status_listeners = []  # Called with every new status, from whichever thread set it
+log_writer = get_log_writer(LOG_FILE)
+# Part of every ETag, so clients never reuse responses from before a restart
+BOOT_ID = str(int(time.time()))
+SSE_KEEPALIVE_SEC = 15
+ROUNDS_API_LIMIT = 50
 
 def log_message(msg):
     print(msg)
-    with open(LOG_FILE, 'a') as f:
-        f.write(msg + '\n')
+    line = format_line(msg)
+    log_writer.write(line)
+    event_bus.publish('log', line)
+
+def set_status(status):
+    if run_state['status'] != status:
+        run_state['status'] = status
+        event_bus.publish('state', status)
+        for listener in list(_status_listeners):
+            listener(status)
 
 def read_counts():
-    counts = {tray: 0 for tray in TRAYS}
-    if os.path.exists(COUNT_FILE):
-        with open(COUNT_FILE, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) == 3 and parts[0] in TRAYS:
-                    counts[parts[0]] = int(parts[2])
-    return counts
-
-def write_counts(counts):
-    with open(COUNT_FILE, 'w') as f:
-        for tray in TRAYS:
-            f.write(f"{tray} count: {counts[tray]}\n")
+    # Cached in memory by the round store
+    return get_round_store().counts()
 
 def read_log():
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'r') as f:
-            return f.readlines()[-30:]
-    return []
-
-def controller_loop(serial_port='/dev/ttyACM0', baud_rate=9600, camera_index=0):
-    global tray_counts, controller_thread
-    # Load previous tray counts
-    tray_counts = read_counts()
-    try:
-        ser = serial.Serial(serial_port, baud_rate, timeout=1)
-        time.sleep(2)
-        log_message(f"Connected to Arduino on {serial_port}")
-    except Exception as e:
-        log_message(f"Serial connection error: {e}")
-        run_state['status'] = 'stopped'
-        controller_thread = None  # Clear thread reference
-        return
+    # In-memory tail; the dashboard never reads system.log
+    return log_writer.tail()
 
-    while True:
-        # Handle stop/pauses
-        while run_state['status'] == 'paused':
+async def wait_for_state(events, round_state, target_state, on_event=None):
+    """
+    Consumes Arduino events until the round reaches `target_state`.
+    Awaits the event queue, so it reacts as soon as a line arrives; a stop
+    cancels the wait. `on_event` is called with every event that is consumed.
+    Raises SerialLinkLost when the reader loses the port.
+    """
+    while round_state.state != target_state:
+        event = await events.get()
+        if event.kind == SERIAL_ERROR:
+            raise SerialLinkLost(f"read error: {event.line}")
+        log_message(f"Arduino: {event.line}")
+        if on_event is not None:
+            on_event(event)
+        round_state.handle(event)
+
+async def run_controller(serial_port='/dev/ttyACM0', baud_rate=9600, camera_index=0, pipelined=PIPELINED_DETECTION,
+                         overhead_qr=OVERHEAD_QR):
+    """
+    The sorting controller as an asyncio task. Each phase awaits Arduino
+    events, camera work (run in worker threads) or the pause gate. Setting
+    the status to 'stopped' cancels the task wherever it is waiting, and
+    'paused' holds it before the next detection or scan.
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    resumed = asyncio.Event()
+    watchers = set()   # Cancel events of running tray watchers
+    shutting_down = False
+
+    def apply_status(status):
+        if status == 'stopped':
+            if not shutting_down:
+                task.cancel()
+        elif status == 'paused':
+            resumed.clear()
+            # Stop watching an empty tray; the watch resumes with the run
+            for watch_cancel in watchers:
+                watch_cancel.set()
             log_message("System paused.")
-            time.sleep(2)
-        if run_state['status'] == 'stopped':
-            log_message("System stopped.")
-            controller_thread = None  # Clear thread reference
-            break
-
-        # Stop if any tray is full
-        full_trays = [tray for tray, count in tray_counts.items() if count >= 4]
-        if full_trays:
-            log_message(f"Tray(s) full: {', '.join(full_trays)}. System stopped. Please reset.")
-            run_state['status'] = 'stopped'
-            controller_thread = None  # Clear thread reference
-            break
-
-        # Wait for Arduino prompt for slider/arm action
-        log_message("Waiting for Arduino to request slider/arm input...")
-        while True:
-            if run_state['status'] == 'paused':
-                break
-            if run_state['status'] == 'stopped':
-                log_message("System stopped by user.")
-                controller_thread = None  # Clear thread reference
-                return
-            if ser.in_waiting:
-                line = ser.readline().decode('utf-8').strip()
-                log_message(f"Arduino: {line}")
-                if "slider position" in line:
-                    break
-            time.sleep(0.2)
-
-        if run_state['status'] != 'running':
-            continue
-
-        # Automated cell selection, check for empty tray
-        cell_label = select_random_cell_and_format()
-        retry_count = 0
-        while cell_label is None:
-            log_message("No object detected in tray. Retrying in 10 seconds...")
-            for _ in range(10):
-                if run_state['status'] != 'running':
-                    break
-                time.sleep(1)
-            cell_label = select_random_cell_and_format()
-            retry_count += 1
-            if retry_count >= 12:
-                log_message("No object detected after multiple retries. System stopped.")
-                run_state['status'] = 'stopped'
-                controller_thread = None  # Clear thread reference
-                return
-        if run_state['status'] != 'running':
-            continue
+        else:
+            resumed.set()
 
-        # Random arm action
-        arm_actions = ['a', 'b', 'c', 'd']
-        arm = random.choice(arm_actions)
-        log_message(f"Automated selection: Slider cell '{cell_label}', Arm '{arm}'")
-        user_input = f"{cell_label} {arm}"
+    def on_status(status):
+        # Called from Flask threads; hand the change to the controller's loop
+        loop.call_soon_threadsafe(apply_status, status)
 
-        # Send slider/arm input to Arduino
-        ser.write((user_input + '\n').encode())
-        log_message(f"Sent to Arduino: {user_input}")
+    async def pause_gate():
+        if not resumed.is_set():
+            await resumed.wait()
 
-        # Wait for READY_TO_SCAN from Arduino
-        log_message("Waiting for Arduino to signal READY_TO_SCAN...")
-        while True:
-            if run_state['status'] == 'paused':
-                break
-            if run_state['status'] == 'stopped':
-                log_message("System stopped by user.")
-                controller_thread = None  # Clear thread reference
+    if run_state['status'] == 'stopped':
+        return
+    _status_listeners.append(on_status)
+    apply_status(run_state['status'])
+
+    link = get_link(serial_port, baud_rate)
+    events = LoopQueue(loop)
+    round_state = RoundStateMachine()
+    round_info = {}
+    pick_misses = {}   # cell -> consecutive missed picks
+    skipped_cells = set()
+    try:
+        prefetcher = NextCellPrefetcher(camera_index=0, with_codes=overhead_qr)
+
+        def on_tray_clear(event):
+            cm = arrived_cm(event)
+            if cm is None or cm < TRAY_CLEAR_CM or round_info.get('tray_cleared'):
                 return
-            if ser.in_waiting:
-                line = ser.readline().decode('utf-8').strip()
-                log_message(f"Arduino: {line}")
-                if "READY_TO_SCAN" in line:
-                    break
-            time.sleep(0.2)
-        if run_state['status'] != 'running':
-            continue
-
-        # Scan QR code for tray selection
-        log_message("Scanning QR code for tray number (live, 5s timeout)...")
-        try:
-            tray_code = scan_qr_live_cropped_timeout(camera_index=camera_index, timeout_sec=5)
-            log_message(f"QR scan result: {tray_code}")
-        except Exception as e:
-            log_message(f"QR scan error: {e}")
-            tray_code = None
-
-        if tray_code not in [t.lower() for t in TRAYS]:
-            log_message("No valid QR code detected. Defaulting to tray 'b4'.")
-            tray_code = 'b4'
-        else:
-            log_message(f"Detected tray code: {tray_code}")
+            round_info['tray_cleared'] = True
+            # Check the picked cell while nothing blocks the tray camera. A round resumed
+            # after a restart ("READY SORT") was picked by the previous run, so there is no cell
+            if 'cell' in round_info:
+                round_info['verify'] = asyncio.ensure_future(
+                    asyncio.to_thread(verify_pick, round_info['cell'], round_info.get('reference'), 0))
+            if pipelined:
+                log_message("Arm cleared the tray. Prefetching next cell...")
+                prefetcher.start()
+
+        async def pick_verdict():
+            """Waits for the post-pick check once per round; True, False (missed) or None (unknown)."""
+            if 'picked' not in round_info:
+                picked = await round_info['verify'] if 'verify' in round_info else None
+                round_info['picked'] = picked
+                if picked is not None:
+                    cell = round_info['cell']
+                    get_round_store().record_pick(cell, round_info['arm'], picked)
+                    PICKS.inc(result='picked' if picked else 'missed')
+                    if picked:
+                        pick_misses.pop(cell, None)
+                    else:
+                        log_message(f"Pick missed: item still in cell {cell} after arm '{round_info['arm']}'.")
+                        pick_misses[cell] = pick_misses.get(cell, 0) + 1
+                        if pick_misses[cell] >= MAX_PICK_MISSES:
+                            skipped_cells.add(cell)
+                            log_message(f"Operator alert: cell {cell} missed {pick_misses[cell]} picks in a row. "
+                                        f"Skipping it until the tray changes; please check the item.")
+            return round_info['picked']
+
+        async def detect():
+            """Returns (CellSelection or None, the tray frame it was planned on or None)."""
+            with PHASE_SECONDS.time(phase='detection'):
+                frame = await asyncio.to_thread(capture_tray_frame, 2, 0)
+                if frame is None:
+                    return None, None
+                return await asyncio.to_thread(plan_pick, frame, overhead_qr, frozenset(skipped_cells)), frame
+
+        async def select_cell():
+            """Returns the CellSelection for this round, or None for an empty tray."""
+            selection = None
+            if pipelined:
+                with PHASE_SECONDS.time(phase='detection') as span:
+                    selection = await asyncio.to_thread(prefetcher.take)
+                    if selection is None:
+                        # Timed again by the detection that follows
+                        span.discard()
+            if selection is not None and selection.cell in skipped_cells:
+                # Prefetched before the pick verdict that put the cell on the skip list
+                selection = None
+            if selection is not None:
+                log_message(f"Using prefetched cell: {selection.cell}")
+                return selection
+            selection, frame = await detect()
+            deadline = time.monotonic() + EMPTY_TRAY_TIMEOUT_SEC
+            while selection is None and time.monotonic() < deadline:
+                if skipped_cells:
+                    log_message(f"No cell left to pick (skipping {', '.join(sorted(skipped_cells))}). "
+                                f"Watching the tray for a change...")
+                else:
+                    log_message("No object detected in tray. Watching the tray for a refill...")
+                # Compared with the frame detection ran on, so a refill in between is not missed
+                watch_cancel = threading.Event()
+                watchers.add(watch_cancel)
+                try:
+                    # Idle time until a refill, kept out of the detection latency
+                    with PHASE_SECONDS.time(phase='empty_wait'):
+                        changed = await asyncio.to_thread(
+                            wait_for_tray_change, 0, deadline - time.monotonic(), watch_cancel, frame)
+                except asyncio.CancelledError:
+                    watch_cancel.set()
+                    raise
+                finally:
+                    watchers.discard(watch_cancel)
+                if not changed:
+                    if resumed.is_set():
+                        break
+                    # A pause stopped the watcher; the pause does not count towards the timeout
+                    paused_at = time.monotonic()
+                    await pause_gate()
+                    deadline += time.monotonic() - paused_at
+                    continue
+                await pause_gate()
+                log_message("Tray changed. Detecting again...")
+                if skipped_cells:
+                    # The operator may have fixed the stuck items, so give those cells another chance
+                    for cell in skipped_cells:
+                        pick_misses.pop(cell, None)
+                    skipped_cells.clear()
+                DETECTION_RETRIES.inc()
+                selection, frame = await detect()
+            return selection
+
+        async def sync_link():
+            """
+            Opens the shared serial link if needed (with backoff) and checks
+            the sketch is ready with a handshake instead of waiting out a
+            reset. Sets the round state from the reply; False if unreachable.
+            """
+            nonlocal round_info
+            connect_cancel = threading.Event()
+            try:
+                connected = await asyncio.to_thread(link.connect, connect_cancel, log_message)
+            except asyncio.CancelledError:
+                connect_cancel.set()
+                raise
+            if not connected:
+                SERIAL_ERRORS.inc()
+                return False
+            link.attach(events)
+            try:
+                reply = await link.handshake(events)
+            except SerialLinkLost as e:
+                log_message(f"Serial write error: {e}")
+                reply = None
+            if reply is None:
+                SERIAL_ERRORS.inc()
+                log_message(f"Arduino on {serial_port} did not answer the handshake.")
+                return False
+            log_message(f"Connected to Arduino on {serial_port} ({reply})")
+            round_state.reset()
+            round_info = {'phase_times': {}, 'started': time.monotonic()}
+            if reply == "READY SORT":
+                # An item from the previous run is waiting at the scanning area
+                round_state.action('resume_scan')
+            return True
 
-        ser.write((tray_code + '\n').encode())
-        log_message(f"Sent to Arduino: {tray_code}")
+        if not await sync_link():
+            set_status('stopped')
+            return
 
-        # Wait for ROUND_COMPLETE from Arduino
-        log_message("Waiting for Arduino to signal ROUND_COMPLETE...")
         while True:
-            if run_state['status'] == 'paused':
-                break
-            if run_state['status'] == 'stopped':
-                log_message("System stopped by user.")
-                controller_thread = None  # Clear thread reference
-                return
-            if ser.in_waiting:
-                response = ser.readline().decode('utf-8').strip()
-                log_message(f"Arduino: {response}")
-                if "ROUND_COMPLETE" in response:
-                    break
-            time.sleep(0.2)
-        if run_state['status'] != 'running':
-            continue
-
-        # Update counts and log to file
-        tray_code = tray_code.upper()
-        tray_counts[tray_code] += 1
-        write_counts(tray_counts)
-
-        log_message("Tray counts so far:")
-        for key in TRAYS:
-            log_message(f"{key} count: {tray_counts[key]}")
-        log_message("Round complete. Ready for next round!\n")
-
-    controller_thread = None  # Ensure thread reference is cleared on normal exit
+            try:
+                if round_state.state == WAITING_FOR_PROMPT:
+                    # Stop if any tray is full
+                    full_trays = [tray for tray, count in read_counts().items() if count >= 4]
+                    if full_trays:
+                        log_message(f"Tray(s) full: {', '.join(full_trays)}. System stopped. Please reset.")
+                        set_status('stopped')
+                        return
 
-@app.route('/', methods=['GET', 'POST'])
-def index():
-    global run_state
+                    # Wait for Arduino prompt for slider/arm action
+                    log_message("Waiting for Arduino to request slider/arm input...")
+                    with PHASE_SECONDS.time(phase='wait_prompt'):
+                        await wait_for_state(events, round_state, SELECTING_CELL)
+                    round_info = {'phase_times': {'t_prompt': time.time()}, 'started': time.monotonic()}
+
+                if round_state.state == SELECTING_CELL:
+                    # Automated cell selection, check for empty tray
+                    await pause_gate()
+                    # select_cell() times each detection; the empty-tray watch is 'empty_wait'
+                    selection = await select_cell()
+                    if selection is None:
+                        if skipped_cells:
+                            log_message(f"Operator alert: only cells the arm keeps missing are occupied "
+                                        f"({', '.join(sorted(skipped_cells))}). System stopped.")
+                        else:
+                            log_message(f"No object detected for {EMPTY_TRAY_TIMEOUT_SEC} seconds. System stopped.")
+                        set_status('stopped')
+                        return
+                    cell_label, known_tray = selection.cell, selection.code
+
+                    # The row letter's action, unless past picks show another action that can reach
+                    # this cell clears it better without reaching into an occupied neighbour
+                    arm = choose_arm(cell_label, get_round_store().pick_stats(), selection.detected)
+                    log_message(f"Automated selection: Slider cell '{cell_label}', Arm '{arm}'")
+                    # The plan assumed the row's own pose; cost the round with the arm actually sent
+                    expected_sec = round_time(cell_label, known_tray, arm=arm)
+                    log_message(f"Expected round time: {expected_sec:.1f}s")
+                    round_info['expected_sec'] = expected_sec
+                    user_input = f"{cell_label.split()[0]} {arm}"
+                    if known_tray is not None:
+                        # The sketch sorts straight to this tray and skips the scan station
+                        log_message(f"Tray code {known_tray} read by the tray camera. Skipping the scan station.")
+                        user_input += f" {known_tray}"
+
+                    # Reference for the post-pick check, while the arm is still home
+                    round_info['reference'] = await asyncio.to_thread(capture_tray_reference, 0)
+
+                    # Send slider/arm input to Arduino
+                    link.write_line(user_input)
+                    log_message(f"Sent to Arduino: {user_input}")
+                    round_info['cell'], round_info['arm'] = cell_label, arm
+                    round_info['phase_times']['t_cell_sent'] = time.time()
+                    if known_tray is not None:
+                        round_state.action('cell_and_tray_sent')
+                        round_info['qr_result'] = known_tray
+                        round_info['tray'] = known_tray.upper()
+                        round_info['phase_times']['t_tray_sent'] = round_info['phase_times']['t_cell_sent']
+                    else:
+                        round_state.action('cell_sent')
+
+                if round_state.state == WAITING_FOR_SCAN:
+                    # Wait for READY_TO_SCAN from Arduino
+                    log_message("Waiting for Arduino to signal READY_TO_SCAN...")
+                    with PHASE_SECONDS.time(phase='motion'):
+                        await wait_for_state(events, round_state, SCANNING, on_event=on_tray_clear)
+                    round_info['phase_times']['t_ready_to_scan'] = time.time()
+
+                if round_state.state == SCANNING:
+                    await pause_gate()
+                    if await pick_verdict() is False:
+                        # Nothing reached the scan station: skip the scan and the sort
+                        link.write_line('x')
+                        log_message("Sent to Arduino: x")
+                        round_state.action('abort_sent')
+                        round_info['tray'] = None
+                        round_info['phase_times']['t_tray_sent'] = time.time()
+
+                if round_state.state == SCANNING:
+                    # Scan QR code for tray selection
+                    log_message("Scanning QR code for tray number (voting, 5s timeout)...")
+                    scan_cancel = threading.Event()
+                    with PHASE_SECONDS.time(phase='scan'):
+                        try:
+                            result = await asyncio.to_thread(
+                                scan_qr_voting, camera_index=camera_index, timeout_sec=5, cancel=scan_cancel)
+                            log_message(f"QR scan result: {result.code} (confidence {result.confidence:.2f}, "
+                                        f"{result.frames} frames, {result.elapsed:.2f}s)")
+                        except asyncio.CancelledError:
+                            scan_cancel.set()
+                            raise
+                        except Exception as e:
+                            log_message(f"QR scan error: {e}")
+                            result = None
+                    tray_code = result.code if result is not None and result.confidence > QR_MIN_CONFIDENCE else None
+                    round_info['qr_result'] = tray_code
+
+                    if tray_code not in [t.lower() for t in TRAYS]:
+                        QR_FALLBACKS.inc()
+                        log_message("No valid QR code detected. Defaulting to tray 'b4'.")
+                        tray_code = 'b4'
+                    else:
+                        log_message(f"Detected tray code: {tray_code}")
+
+                    link.write_line(tray_code)
+                    log_message(f"Sent to Arduino: {tray_code}")
+                    round_state.action('tray_sent')
+                    round_info['tray'] = tray_code.upper()
+                    round_info['phase_times']['t_tray_sent'] = time.time()
+
+                if round_state.state == WAITING_FOR_COMPLETE:
+                    # Wait for ROUND_COMPLETE from Arduino
+                    log_message("Waiting for Arduino to signal ROUND_COMPLETE...")
+                    # Direct rounds go from the pick straight to the sorted area
+                    phase = 'sort' if 't_ready_to_scan' in round_info['phase_times'] else 'pick_and_sort'
+                    with PHASE_SECONDS.time(phase=phase) as span:
+                        if round_info.get('picked') is False:
+                            span.discard()
+                        await wait_for_state(events, round_state, ROUND_DONE, on_event=on_tray_clear)
+                    round_info['phase_times']['t_complete'] = time.time()
+
+                if round_state.state == ROUND_DONE:
+                    if await pick_verdict() is False:
+                        # Direct rounds sort before the verdict is known; an empty gripper is not counted
+                        log_message("Nothing was sorted this round; tray counts unchanged.")
+                        round_info['tray'] = None
+                    # Store the round and update counts in one transaction
+                    tray_counts = get_round_store().record_round(
+                        round_info.get('cell'), round_info.get('arm'), round_info.get('qr_result'),
+                        round_info['tray'], round_info['phase_times'], round_info.get('expected_sec'),
+                    )
+                    if round_info['tray'] is not None:
+                        event_bus.publish('counts', tray_counts)
+                        ROUNDS.inc()
+                        PHASE_SECONDS.observe(time.monotonic() - round_info['started'], phase='round')
+
+                    log_message("Tray counts so far:")
+                    for key in TRAYS:
+                        log_message(f"{key} count: {tray_counts[key]}")
+                    log_message("Round complete. Ready for next round!\n")
+                    round_state.action('next_round')
+            except SerialLinkLost as e:
+                SERIAL_ERRORS.inc()
+                log_message(f"Serial link lost ({e}). Reconnecting...")
+                if not await sync_link():
+                    set_status('stopped')
+                    return
+    except asyncio.CancelledError:
+        log_message("System stopped.")
+    except Exception as e:
+        # Without this the task dies silently and the dashboard keeps showing 'running'
+        log_message(f"Controller error: {e!r}")
+        for line in traceback.format_exc().rstrip().splitlines():
+            log_message(line)
+        log_message("System stopped.")
+        set_status('stopped')
+    finally:
+        shutting_down = True
+        _status_listeners.remove(on_status)
+        # The link stays open for the next run
+        link.detach(events)
+
+def controller_loop(**kwargs):
+    """Runs the controller on its own event loop until it stops (blocking)."""
+    asyncio.run(run_controller(**kwargs))
+
+class ControllerRuntime:
+    """
+    Owns the event loop thread the controller task runs on. Web handlers
+    only schedule work on it with call_soon_threadsafe, so they never block.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._task = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            return self._loop
+
+    def start(self, **kwargs):
+        self._ensure_loop().call_soon_threadsafe(self._start_task, kwargs)
+
+    def _start_task(self, kwargs):
+        self._task = self._loop.create_task(self._run_after(self._task, kwargs))
+
+    async def _run_after(self, previous, kwargs):
+        # A stopped run may still be detaching from the serial link
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        await run_controller(**kwargs)
+
+controller_runtime = ControllerRuntime()
+
+def dashboard_state():
     counts = read_counts()
-    logs = read_log()
-    tray_full = any(c >= 4 for c in counts.values())
     full_trays = [tray for tray, c in counts.items() if c >= 4]
+    return {
+        'status': run_state['status'],
+        'counts': counts,
+        'tray_full': bool(full_trays),
+        'full_trays': full_trays,
+    }
+
+def conditional_json(read_data, *topics):
+    """
+    JSON response with an ETag built from the topic versions; answers 304
+    when unchanged. The versions are read before `read_data()` is called,
+    so a publish in between can only make the ETag older than the data,
+    never newer.
+    """
+    etag = '-'.join([BOOT_ID] + [str(event_bus.version(topic)) for topic in topics])
+    response = jsonify(read_data())
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+@app.route('/', methods=['GET', 'POST'])
+def index():
+    state = dashboard_state()
     return render_template(
         'index.html',
-        counts=counts,
-        logs=logs,
-        tray_full=tray_full,
-        full_trays=full_trays,
-        run_status=run_state['status']
+        counts=state['counts'],
+        logs=read_log(),
+        tray_full=state['tray_full'],
+        full_trays=state['full_trays'],
+        run_status=state['status']
     )
 
+@app.route('/api/state')
+def api_state():
+    def read_state():
+        state = dashboard_state()
+        state['logs'] = read_log()
+        return state
+    return conditional_json(read_state, 'state', 'counts', 'log')
+
+@app.route('/api/counts')
+def api_counts():
+    return conditional_json(read_counts, 'counts')
+
+@app.route('/api/picks')
+def api_picks():
+    """Verified pick outcomes per cell and arm action."""
+    return jsonify([
+        {'cell': cell, 'arm': arm, 'attempts': attempts, 'successes': successes,
+         'success_rate': round(successes / attempts, 3)}
+        for (cell, arm), (attempts, successes) in sorted(get_round_store().pick_stats().items())
+    ])
+
+@app.route('/api/rounds')
+def api_rounds():
+    """Latest rounds of the current epoch, with the expected and measured round time."""
+    limit = request.args.get('limit', ROUNDS_API_LIMIT, type=int)
+    return jsonify(get_round_store().recent_rounds(limit))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Phase histograms and counters in the Prometheus text format."""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/events')
+def events_stream():
+    """
+    Server-Sent Events: pushes 'state', 'counts' and 'log' updates as they
+    happen. A 'log' event with null data means the log was cleared.
+    """
+    def stream():
+        subscription = event_bus.subscribe()
+        try:
+            yield format_sse('state', run_state['status'])
+            yield format_sse('counts', read_counts())
+            while True:
+                try:
+                    topic, data = subscription.get(timeout=SSE_KEEPALIVE_SEC)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(topic, data)
+        finally:
+            event_bus.unsubscribe(subscription)
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/control', methods=['POST'])
 def control():
-    global run_state, controller_thread
     cmd = request.form.get('cmd')
     if cmd == 'start':
-        # Restart safety: join previous thread if still alive
         if run_state['status'] == 'stopped':
-            if controller_thread is not None and controller_thread.is_alive():
-                log_message("Waiting for previous controller thread to finish...")
-                controller_thread.join(timeout=2)
-            run_state['status'] = 'running'
-            controller_thread = threading.Thread(target=controller_loop)
-            controller_thread.daemon = True
-            controller_thread.start()
+            set_status('running')
+            controller_runtime.start()
         elif run_state['status'] == 'paused':
-            run_state['status'] = 'running'
+            set_status('running')
     elif cmd == 'pause':
         if run_state['status'] == 'running':
-            run_state['status'] = 'paused'
+            set_status('paused')
     elif cmd == 'stop':
-        run_state['status'] = 'stopped'
-        # Optionally join thread to ensure clean stop
-        if controller_thread is not None and controller_thread.is_alive():
-            controller_thread.join(timeout=2)
-        controller_thread = None
+        # Cancels the controller task; it closes the serial port on its own
+        set_status('stopped')
     return redirect(url_for('index'))
 
 @app.route('/reset', methods=['POST'])
 def reset():
-    global tray_counts, run_state, controller_thread
-    tray_counts = {tray: 0 for tray in TRAYS}
-    write_counts(tray_counts)
-    open(LOG_FILE, 'w').close()
-    run_state['status'] = 'stopped'
-    # Ensure thread is stopped and cleaned up
-    if controller_thread is not None and controller_thread.is_alive():
-        log_message("Waiting for previous controller thread to finish (reset)...")
-        controller_thread.join(timeout=2)
-    controller_thread = None
+    set_status('stopped')
+    get_round_store().reset()
+    event_bus.publish('counts', get_round_store().counts())
+    log_writer.clear()
+    event_bus.publish('log', None)  # Tells dashboards to clear their log view
     return redirect(url_for('index'))
 
 if __name__ == '__main__':
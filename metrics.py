@@ -0,0 +1,136 @@
+import bisect
+import threading
+import time
+
+# Upper bounds (seconds) for phase histograms; rounds take tens of seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 40, 60, 120)
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter, optionally split by label values."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.label_names:
+            values = [((), 0)]
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+class Span:
+    """Times one phase on the monotonic clock; observed on exit unless discarded."""
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = None
+        self._discarded = False
+
+    def discard(self):
+        """Drops this measurement, e.g. when the phase was interrupted by pause/stop."""
+        self._discarded = True
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and not self._discarded:
+            self._histogram.observe(time.monotonic() - self._start, **self._labels)
+        return False
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus layout, optionally split
+    by label values. An observation is one bisect and a few additions under
+    a lock, so it is cheap enough to wrap every phase of every round.
+    """
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}   # label key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0] * (len(self.buckets) + 2)
+                self._series[key] = series
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        return Span(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(float(series[-1]))}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+PHASE_SECONDS = registry.register(Histogram(
+    "sorting_phase_seconds", "Duration of each phase of a sorting round.", label_names=("phase",)))
+ROUNDS = registry.register(Counter(
+    "sorting_rounds_total", "Completed sorting rounds."))
+PICKS = registry.register(Counter(
+    "sorting_picks_total", "Picks checked on the tray camera after the round.", label_names=("result",)))
+DETECTION_RETRIES = registry.register(Counter(
+    "sorting_detection_retries_total", "Tray detections retried because no object was found."))
+QR_FALLBACKS = registry.register(Counter(
+    "sorting_qr_fallback_total", "QR scans that defaulted to tray b4."))
+SERIAL_ERRORS = registry.register(Counter(
+    "sorting_serial_errors_total", "Serial connection and read errors."))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -1,5 +1,8 @@
 import cv2
-import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config_cache import write_json_atomic
 
 rectangles = []
 drawing = False
@@ -51,8 +54,8 @@ def main():
             break
         if key == ord('s'):
             filename = "tray_cells.json"
-            with open(filename, "w") as f:
-                json.dump(rectangles, f, indent=2)
+            # Atomic write; a running controller picks it up without a restart
+            write_json_atomic(filename, rectangles)
             print(f"Saved {len(rectangles)} rectangles to {filename}.")
             break
 
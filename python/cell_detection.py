@@ -1,10 +1,9 @@
 import cv2
 import numpy as np
-import json
-
-def load_cell_labels(filename="tray_cells.json"):
-    with open(filename, "r") as f:
-        return json.load(f)
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cell_map import load_cell_map
 
 MIN_AREA = 900
 MAX_AREA = 90000
@@ -55,16 +54,7 @@ def identify_valid_contours(contours, height, width):
             valid_indices.append(idx)
     return valid_indices
 
-def assign_cell(cx, cy, cell_labels):
-    for cell in cell_labels:
-        x, y, w, h = cell["x"], cell["y"], cell["w"], cell["h"]
-        if x <= cx <= x+w and y <= cy <= y+h:
-            return cell["label"]
-    return None
-
 def main():
-    cell_labels = load_cell_labels("tray_cells.json")
-
     print("Step 1: Capture background image (no object).")
     bg_img = capture_image(window_name="Background Image")
     if bg_img is None:
@@ -81,11 +71,12 @@ def main():
     diff = calculate_difference_otsu(img, bg_img)
     contours, _ = cv2.findContours(diff, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     height, width = img.shape[:2]
+    cell_map = load_cell_map("tray_cells.json", (height, width))
     valid_indices = identify_valid_contours(contours, height, width)
     output_img = img.copy()
 
     # Draw cell boundaries and labels for visualization
-    for cell in cell_labels:
+    for cell in cell_map.cells:
         cv2.rectangle(output_img, (cell["x"], cell["y"]), (cell["x"]+cell["w"], cell["y"]+cell["h"]), (255,0,0), 1)
         cv2.putText(output_img, cell["label"], (cell["x"], cell["y"]-5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,0,0), 1)
 
@@ -96,7 +87,7 @@ def main():
         cx = int(M['m10']/M['m00']) if M['m00'] != 0 else None
         cy = int(M['m01']/M['m00']) if M['m00'] != 0 else None
         if cx is not None and cy is not None:
-            cell_label = assign_cell(cx, cy, cell_labels)
+            cell_label = cell_map.assign(cx, cy)
             if cell_label:
                 cv2.circle(output_img, (cx, cy), 5, (0,255,0), -1)
                 cv2.putText(output_img, cell_label, (cx+10, cy), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,255), 2)
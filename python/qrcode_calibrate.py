@@ -1,5 +1,8 @@
 import cv2
-import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config_cache import write_json_atomic
 
 def main():
     camera_index = 2
@@ -62,8 +65,8 @@ def main():
                     "width": crop_width,
                     "height": crop_height
                 }
-                with open("crop_box.json", "w") as f:
-                    json.dump(crop_box, f, indent=2)
+                # Atomic write; a running controller picks it up without a restart
+                write_json_atomic("crop_box.json", crop_box)
                 print("Saved crop box to crop_box.json:", crop_box)
                 break
 
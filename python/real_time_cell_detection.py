@@ -1,15 +1,14 @@
 import cv2
 import numpy as np
-import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cell_map import load_cell_map
 
 MIN_AREA = 900
 MAX_AREA = 90000
 OTSU_SENSITIVITY = 22
 
-def load_cell_labels(filename="tray_cells.json"):
-    with open(filename, "r") as f:
-        return json.load(f)
-
 def calculate_difference_otsu(img, bg_img):
     bg_gray = cv2.cvtColor(bg_img, cv2.COLOR_BGR2GRAY)
     img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -32,15 +31,7 @@ def identify_valid_contours(contours, height, width):
             valid_indices.append(idx)
     return valid_indices
 
-def assign_cell(cx, cy, cell_labels):
-    for cell in cell_labels:
-        x, y, w, h = cell["x"], cell["y"], cell["w"], cell["h"]
-        if x <= cx <= x+w and y <= cy <= y+h:
-            return cell["label"]
-    return None
-
 def main():
-    cell_labels = load_cell_labels("tray_cells.json")
     bg_img = cv2.imread("background.jpg")
     if bg_img is None:
         print("Error: 'background.jpg' not found. Run save_background_image.py first.")
@@ -62,11 +53,12 @@ def main():
         diff = calculate_difference_otsu(frame, bg_img)
         contours, _ = cv2.findContours(diff, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         height, width = frame.shape[:2]
+        cell_map = load_cell_map("tray_cells.json", (height, width))
         valid_indices = identify_valid_contours(contours, height, width)
         output_img = frame.copy()
 
         # Draw cell boundaries and labels
-        for cell in cell_labels:
+        for cell in cell_map.cells:
             cv2.rectangle(output_img, (cell["x"], cell["y"]), (cell["x"]+cell["w"], cell["y"]+cell["h"]), (255,0,0), 1)
             cv2.putText(output_img, cell["label"], (cell["x"], cell["y"]-5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,0,0), 1)
 
@@ -77,7 +69,7 @@ def main():
             cx = int(M['m10']/M['m00']) if M['m00'] != 0 else None
             cy = int(M['m01']/M['m00']) if M['m00'] != 0 else None
             if cx is not None and cy is not None:
-                cell_label = assign_cell(cx, cy, cell_labels)
+                cell_label = cell_map.assign(cx, cy)
                 if cell_label:
                     cv2.circle(output_img, (cx, cy), 5, (0,255,0), -1)
                     cv2.putText(output_img, cell_label, (cx+10, cy), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,255), 2)
@@ -0,0 +1,143 @@
+import threading
+from collections import namedtuple
+import cv2
+import numpy as np
+from config_cache import CropBox
+
+try:
+    from pyzbar.pyzbar import decode as zbar_decode, ZBarSymbol
+except ImportError:  # libzbar missing; the OpenCV backends still work
+    zbar_decode = None
+
+# One decoded code: text and its bounding rectangle (x, y, w, h) in the decoded image
+QRRead = namedtuple('QRRead', ['data', 'rect'])
+
+ROI_MARGIN = 2.0        # Tracked ROI side as a multiple of the code's size
+ROI_MIN_SIZE = 96       # Never shrink the tracked ROI below this many pixels
+ROI_SMOOTHING = 0.5     # Weight of the newest sighting in the tracked position
+
+class PyzbarDecoder:
+    name = 'pyzbar'
+
+    def available(self):
+        return zbar_decode is not None
+
+    def decode(self, gray):
+        reads = []
+        for obj in zbar_decode(gray, symbols=[ZBarSymbol.QRCODE]):
+            rect = obj.rect
+            reads.append(QRRead(obj.data.decode("utf-8"), (rect.left, rect.top, rect.width, rect.height)))
+        return reads
+
+class OpenCVDecoder:
+    """cv2.QRCodeDetector, or cv2.QRCodeDetectorAruco (OpenCV >= 4.8) with `aruco`."""
+
+    def __init__(self, aruco=False):
+        self.name = 'opencv_aruco' if aruco else 'opencv'
+        self._aruco = aruco
+        # Detectors keep state between calls, so use one per thread
+        self._local = threading.local()
+
+    def available(self):
+        return not self._aruco or hasattr(cv2, 'QRCodeDetectorAruco')
+
+    def _detector(self):
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = cv2.QRCodeDetectorAruco() if self._aruco else cv2.QRCodeDetector()
+            self._local.detector = detector
+        return detector
+
+    def decode(self, gray):
+        data, points, _ = self._detector().detectAndDecode(gray)
+        if not data or points is None:
+            return []
+        x, y, w, h = cv2.boundingRect(points.reshape(-1, 2).astype(np.float32))
+        return [QRRead(data, (x, y, w, h))]
+
+DECODERS = {
+    'pyzbar': PyzbarDecoder,
+    'opencv': OpenCVDecoder,
+    'opencv_aruco': lambda: OpenCVDecoder(aruco=True),
+}
+
+def register_decoder(name, factory):
+    """Adds a backend; `factory()` must return an object with name, available() and decode(gray)."""
+    DECODERS[name] = factory
+
+def build_decoders(names):
+    """Instantiates the named backends in order, skipping ones that are not available here."""
+    decoders = []
+    for name in names:
+        decoder = DECODERS[name]()
+        if decoder.available():
+            decoders.append(decoder)
+        else:
+            print(f"QR decoder '{name}' is not available; skipping it.")
+    if not decoders:
+        raise RuntimeError(f"None of the QR decoders {list(names)} are available.")
+    return decoders
+
+def decode_first(decoders, gray):
+    """Tries each backend in order and returns the reads of the first that finds a code."""
+    for decoder in decoders:
+        reads = decoder.decode(gray)
+        if reads:
+            return reads
+    return []
+
+class RoiTracker:
+    """
+    Learns where codes actually appear at the scan station. Every read
+    moves a smoothed centre and size towards the code's position in the
+    frame; the tracked ROI is then a box of ROI_MARGIN times the code size
+    around that centre, which is tried before the calibrated crop box.
+    Forgets everything when the calibration changes.
+    """
+
+    def __init__(self, margin=ROI_MARGIN, min_size=ROI_MIN_SIZE, smoothing=ROI_SMOOTHING):
+        self.margin = margin
+        self.min_size = min_size
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._calibrated = None
+        self._center = None
+        self._size = None
+
+    def _check_calibration(self, crop_box):
+        if self._calibrated != tuple(crop_box):
+            self._calibrated = tuple(crop_box)
+            self._center = None
+            self._size = None
+
+    def observe(self, rect, crop_box):
+        """Records a code seen at `rect` (x, y, w, h) in frame coordinates."""
+        x, y, w, h = rect
+        center = (x + w / 2, y + h / 2)
+        size = max(w, h)
+        with self._lock:
+            self._check_calibration(crop_box)
+            if self._center is None:
+                self._center, self._size = center, size
+            else:
+                a = self.smoothing
+                self._center = tuple((1 - a) * old + a * new for old, new in zip(self._center, center))
+                self._size = (1 - a) * self._size + a * size
+
+    def roi(self, crop_box, frame_shape):
+        """Returns the tracked CropBox clipped to the frame, or None before the first read."""
+        with self._lock:
+            self._check_calibration(crop_box)
+            if self._center is None:
+                return None
+            side = max(self.min_size, int(self._size * self.margin))
+            cx, cy = self._center
+        height, width = frame_shape[:2]
+        x = int(min(max(cx - side / 2, 0), max(width - side, 0)))
+        y = int(min(max(cy - side / 2, 0), max(height - side, 0)))
+        return CropBox(x, y, min(side, width - x), min(side, height - y))
+
+    def reset(self):
+        with self._lock:
+            self._center = None
+            self._size = None
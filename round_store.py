@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+from config_cache import get_tray_counts, TRAYS
+
+DB_FILE = "sorting.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS epochs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    epoch INTEGER NOT NULL REFERENCES epochs(id),
+    cell TEXT,
+    arm TEXT,
+    qr_result TEXT,
+    tray TEXT,
+    t_prompt REAL,
+    t_cell_sent REAL,
+    t_ready_to_scan REAL,
+    t_tray_sent REAL,
+    t_complete REAL,
+    expected_sec REAL
+);
+CREATE TABLE IF NOT EXISTS tray_counts (
+    epoch INTEGER NOT NULL REFERENCES epochs(id),
+    tray TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (epoch, tray)
+);
+CREATE TABLE IF NOT EXISTS pick_stats (
+    cell TEXT NOT NULL,
+    arm TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    successes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (cell, arm)
+);
+"""
+
+# Per-phase wall-clock timestamps stored with each round
+PHASES = ('t_prompt', 't_cell_sent', 't_ready_to_scan', 't_tray_sent', 't_complete')
+
+class RoundStore:
+    """
+    Embedded SQLite (WAL mode) store with one row per completed round.
+    Tray counters are updated in the same transaction as the round row and
+    cached in memory, so readers never query the database. A reset starts a
+    new epoch instead of deleting anything. Pick outcomes per cell and arm
+    action are kept across epochs, since they describe the hardware.
+    """
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        is_new = not os.path.exists(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(rounds)")]
+        if 'expected_sec' not in columns:
+            # Databases created before the pick scheduler stored its estimate
+            self._conn.execute("ALTER TABLE rounds ADD COLUMN expected_sec REAL")
+        row = self._conn.execute("SELECT MAX(id) FROM epochs").fetchone()
+        if row[0] is None:
+            # First run: carry over the counts from the old tray_counts.txt
+            seed = get_tray_counts() if is_new else {}
+            self._epoch = self._start_epoch(seed)
+        else:
+            self._epoch = row[0]
+        self._counts = self._load_counts()
+        self._picks = {
+            (cell, arm): (attempts, successes)
+            for cell, arm, attempts, successes in self._conn.execute(
+                "SELECT cell, arm, attempts, successes FROM pick_stats")
+        }
+
+    def _start_epoch(self, seed_counts=None):
+        seed_counts = seed_counts or {}
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            epoch = self._conn.execute(
+                "INSERT INTO epochs (started_at) VALUES (?)", (time.time(),)
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO tray_counts (epoch, tray, count) VALUES (?, ?, ?)",
+                [(epoch, tray, seed_counts.get(tray, 0)) for tray in TRAYS],
+            )
+        return epoch
+
+    def _load_counts(self):
+        counts = {tray: 0 for tray in TRAYS}
+        for tray, count in self._conn.execute(
+            "SELECT tray, count FROM tray_counts WHERE epoch = ?", (self._epoch,)
+        ):
+            counts[tray] = count
+        return counts
+
+    def counts(self):
+        """Returns a copy of the current epoch's tray counts from memory."""
+        with self._lock:
+            return dict(self._counts)
+
+    def record_round(self, cell, arm, qr_result, tray, phase_times=None, expected_sec=None):
+        """
+        Stores a completed round and increments its tray counter atomically.
+        A round with `tray` None (missed pick) is stored without counting.
+        `phase_times` maps names from PHASES to time.time() values and
+        `expected_sec` is the pick scheduler's estimate for the round.
+        Returns the updated counts.
+        """
+        phase_times = phase_times or {}
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute(
+                    "INSERT INTO rounds (epoch, cell, arm, qr_result, tray, "
+                    + ", ".join(PHASES) + ", expected_sec) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self._epoch, cell, arm, qr_result, tray) + tuple(phase_times.get(p) for p in PHASES)
+                    + (expected_sec,),
+                )
+                if tray is not None:
+                    self._conn.execute(
+                        "INSERT INTO tray_counts (epoch, tray, count) VALUES (?, ?, 1) "
+                        "ON CONFLICT (epoch, tray) DO UPDATE SET count = count + 1",
+                        (self._epoch, tray),
+                    )
+            if tray is not None:
+                self._counts[tray] = self._counts.get(tray, 0) + 1
+            return dict(self._counts)
+
+    def recent_rounds(self, limit=50):
+        """
+        Returns the current epoch's latest rounds, newest first, as dicts
+        with the expected seconds and the measured seconds from sending the
+        cell to ROUND_COMPLETE.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, cell, arm, qr_result, tray, t_cell_sent, t_complete, expected_sec FROM rounds "
+                "WHERE epoch = ? ORDER BY id DESC LIMIT ?", (self._epoch, limit),
+            ).fetchall()
+        return [
+            {'id': round_id, 'cell': cell, 'arm': arm, 'qr_result': qr_result, 'tray': tray,
+             'expected_sec': round(expected_sec, 3) if expected_sec is not None else None,
+             'actual_sec': round(t_complete - t_cell_sent, 3) if t_cell_sent and t_complete else None}
+            for round_id, cell, arm, qr_result, tray, t_cell_sent, t_complete, expected_sec in rows
+        ]
+
+    def record_pick(self, cell, arm, success):
+        """Counts one verified pick attempt of `cell` with arm action `arm`."""
+        success = int(bool(success))
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pick_stats (cell, arm, attempts, successes) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (cell, arm) DO UPDATE SET attempts = attempts + 1, successes = successes + ?",
+                (cell, arm, success, success),
+            )
+            attempts, successes = self._picks.get((cell, arm), (0, 0))
+            self._picks[(cell, arm)] = (attempts + 1, successes + success)
+
+    def pick_stats(self):
+        """Returns {(cell, arm): (attempts, successes)} from memory."""
+        with self._lock:
+            return dict(self._picks)
+
+    def reset(self):
+        """Starts a new epoch with all tray counts at zero; history is kept."""
+        with self._lock:
+            self._epoch = self._start_epoch()
+            self._counts = {tray: 0 for tray in TRAYS}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_round_store(path=DB_FILE):
+    """Returns the shared RoundStore for a database file, creating it on first use."""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = RoundStore(path)
+            _stores[path] = store
+        return store
@@ -0,0 +1,162 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import namedtuple
+
+# Event kinds produced from Arduino output lines
+PROMPT = 'PROMPT'                  # "Enter slider position and robot arm action ..."
+READY_TO_SCAN = 'READY_TO_SCAN'
+READY = 'READY'                    # Handshake reply: "READY" at the prompt, "READY SORT" when waiting for a tray code
+SORT_PROMPT = 'SORT_PROMPT'        # "Enter sorted area action ..."
+ROUND_COMPLETE = 'ROUND_COMPLETE'
+ROUND_ABORTED = 'ROUND_ABORTED'    # Sort skipped after the host sent "x" for a missed pick
+ARRIVED = 'ARRIVED'                # "Arrived at 26 cm."
+HOMED = 'HOMED'                    # "Slider homed to position 0cm."
+MESSAGE = 'MESSAGE'                # Any other line
+SERIAL_ERROR = 'SERIAL_ERROR'      # Reader thread lost the port
+
+ArduinoEvent = namedtuple('ArduinoEvent', ['kind', 'line', 'timestamp'])
+
+def classify_line(line):
+    if "slider position" in line:
+        return PROMPT
+    if "READY_TO_SCAN" in line:
+        return READY_TO_SCAN
+    if line == "READY" or line.startswith("READY "):
+        return READY
+    if "ROUND_COMPLETE" in line:
+        return ROUND_COMPLETE
+    if "ROUND_ABORTED" in line:
+        return ROUND_ABORTED
+    if "sorted area action" in line:
+        return SORT_PROMPT
+    if line.startswith("Arrived at"):
+        return ARRIVED
+    if line.startswith("Slider homed"):
+        return HOMED
+    return MESSAGE
+
+def arrived_cm(event):
+    """Returns the slider position from an ARRIVED event, or None."""
+    if event.kind != ARRIVED:
+        return None
+    try:
+        return int(event.line.split()[2])
+    except (IndexError, ValueError):
+        return None
+
+class SerialReader:
+    """
+    Reads Arduino lines on a dedicated thread and puts each one on a queue
+    as a typed ArduinoEvent, so consumers wake up as soon as a line arrives
+    instead of polling `in_waiting`.
+    The serial port should be opened with a read timeout so stop() is honoured.
+    """
+
+    def __init__(self, ser, events=None):
+        self.ser = ser
+        self.events = events if events is not None else queue.Queue()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def is_running(self):
+        return self._running
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                raw = self.ser.readline()
+            except Exception as e:
+                self.events.put(ArduinoEvent(SERIAL_ERROR, str(e), time.monotonic()))
+                self._running = False
+                break
+            if not raw:
+                continue  # Read timeout, check whether we should stop
+            line = raw.decode('utf-8', errors='replace').strip()
+            if line:
+                self.events.put(ArduinoEvent(classify_line(line), line, time.monotonic()))
+
+class LoopQueue:
+    """
+    Thread-safe put() into an asyncio.Queue owned by `loop`, so a
+    SerialReader can feed a controller running on an event loop.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        self._loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    async def get(self):
+        return await self.queue.get()
+
+# Round states, in protocol order
+WAITING_FOR_PROMPT = 'WAITING_FOR_PROMPT'
+SELECTING_CELL = 'SELECTING_CELL'
+WAITING_FOR_SCAN = 'WAITING_FOR_SCAN'
+SCANNING = 'SCANNING'
+WAITING_FOR_COMPLETE = 'WAITING_FOR_COMPLETE'
+ROUND_DONE = 'ROUND_DONE'
+
+# (state, event kind) -> next state; other events leave the state unchanged
+EVENT_TRANSITIONS = {
+    (WAITING_FOR_PROMPT, PROMPT): SELECTING_CELL,
+    (WAITING_FOR_SCAN, READY_TO_SCAN): SCANNING,
+    (WAITING_FOR_COMPLETE, ROUND_COMPLETE): ROUND_DONE,
+    (WAITING_FOR_COMPLETE, ROUND_ABORTED): ROUND_DONE,
+}
+
+# Transitions caused by the controller's own actions
+ACTION_TRANSITIONS = {
+    (SELECTING_CELL, 'cell_sent'): WAITING_FOR_SCAN,
+    # Tray code read by the tray camera and sent with the cell: no scan station
+    (SELECTING_CELL, 'cell_and_tray_sent'): WAITING_FOR_COMPLETE,
+    (SCANNING, 'tray_sent'): WAITING_FOR_COMPLETE,
+    # Pick verified as missed: the sketch skips the sort and re-homes
+    (SCANNING, 'abort_sent'): WAITING_FOR_COMPLETE,
+    # Handshake found the sketch waiting for a tray code from an earlier run
+    (WAITING_FOR_PROMPT, 'resume_scan'): SCANNING,
+    (ROUND_DONE, 'next_round'): WAITING_FOR_PROMPT,
+}
+
+class RoundStateMachine:
+    """Tracks where the current sorting round is in the Arduino protocol."""
+
+    def __init__(self):
+        self.state = WAITING_FOR_PROMPT
+        self.entered_at = time.monotonic()
+
+    def _set_state(self, state):
+        self.state = state
+        self.entered_at = time.monotonic()
+
+    def handle(self, event):
+        """Applies an Arduino event. Returns True if the state changed."""
+        next_state = EVENT_TRANSITIONS.get((self.state, event.kind))
+        if next_state is None:
+            return False
+        self._set_state(next_state)
+        return True
+
+    def action(self, name):
+        next_state = ACTION_TRANSITIONS.get((self.state, name))
+        if next_state is None:
+            raise ValueError(f"Action '{name}' not allowed in state {self.state}")
+        self._set_state(next_state)
+
+    def reset(self):
+        self._set_state(WAITING_FOR_PROMPT)
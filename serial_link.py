@@ -0,0 +1,178 @@
+import asyncio
+import atexit
+import threading
+import time
+import serial
+from serial_events import SerialReader, READY, PROMPT, SORT_PROMPT, SERIAL_ERROR
+
+# Waits between reconnect attempts; the link gives up after the last one
+RECONNECT_DELAYS_SEC = (0.5, 1, 2, 4)
+# Covers a board reset: bootloader plus the homing run in setup()
+HANDSHAKE_TIMEOUT_SEC = 30
+PING_INTERVAL_SEC = 2.0
+
+class SerialLinkLost(Exception):
+    """The port failed while reading or writing."""
+
+class SerialLink:
+    """
+    Keeps the Arduino port open for the life of the app, so a controller
+    run only attaches to it instead of opening the port and rebooting the
+    board. The port is opened with DTR held low, which avoids the reset on
+    drivers that honour it. Lines are read on one SerialReader thread and
+    forwarded to whichever event sink is attached; between runs they are
+    dropped. After a read or write error the next connect() reopens the
+    port with backoff.
+    Use get_link() instead of creating instances directly.
+    """
+
+    def __init__(self, port, baud_rate=9600):
+        self.port = port
+        self.baud_rate = baud_rate
+        self._lock = threading.Lock()
+        self._ser = None
+        self._reader = None
+        self._sink = None
+        self._failed = None   # Port a write failed on; closed off the caller's thread
+
+    # Called by the reader thread with every event
+    def put(self, event):
+        sink = self._sink
+        if sink is not None:
+            sink.put(event)
+
+    def attach(self, sink):
+        self._sink = sink
+
+    def detach(self, sink):
+        if self._sink is sink:
+            self._sink = None
+
+    def is_open(self):
+        return (self._ser is not None and self._ser is not self._failed
+                and self._reader is not None and self._reader.is_running())
+
+    def _open_port(self):
+        ser = serial.Serial()
+        ser.port = self.port
+        ser.baudrate = self.baud_rate
+        ser.timeout = 1
+        ser.dtr = False
+        ser.open()
+        return ser
+
+    def _close_port(self):
+        if self._reader is not None:
+            self._reader.stop()
+            self._reader = None
+        if self._ser is not None:
+            try:
+                self._ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            self._ser = None
+        self._failed = None
+
+    def _release(self, ser):
+        # Only the failed port; connect() may already have opened a new one
+        with self._lock:
+            if self._ser is ser:
+                self._close_port()
+
+    def connect(self, cancel=None, log=print):
+        """
+        Opens the port unless it is already open, retrying with backoff.
+        Blocks; returns True once open, False if every attempt failed or
+        `cancel` (a threading.Event) was set.
+        """
+        cancel = cancel or threading.Event()
+        with self._lock:
+            if self.is_open():
+                return True
+            self._close_port()
+            for delay in (0,) + RECONNECT_DELAYS_SEC:
+                if delay and cancel.wait(delay):
+                    return False
+                try:
+                    self._ser = self._open_port()
+                except (serial.SerialException, OSError) as e:
+                    log(f"Serial connection error on {self.port}: {e}")
+                    continue
+                self._reader = SerialReader(self._ser, self)
+                self._reader.start()
+                return True
+            return False
+
+    def write_line(self, text):
+        ser = self._ser
+        try:
+            ser.write((text + '\n').encode())
+        except (serial.SerialException, OSError, AttributeError) as e:
+            if ser is not None:
+                # Marked at once so the next connect() reopens the port. Closing
+                # joins the reader thread, which must not block the event loop
+                self._failed = ser
+                try:
+                    asyncio.get_running_loop().run_in_executor(None, self._release, ser)
+                except RuntimeError:
+                    self._release(ser)
+            raise SerialLinkLost(str(e))
+
+    async def handshake(self, events, timeout_sec=HANDSHAKE_TIMEOUT_SEC):
+        """
+        Sends PING until the sketch answers with a READY line, consuming
+        events from `events` (the attached LoopQueue) meanwhile. Once any
+        line has arrived the sketch is alive, just busy; it answers the PING
+        already sent when it next reads input, and more would pile up in its
+        64-byte receive buffer in front of the next command. Only a prompt
+        that is not followed by READY (the PING was lost, e.g. during a
+        reset) lets the next PING go out.
+        Returns the READY line, or None on timeout.
+        """
+        deadline = time.monotonic() + timeout_sec
+        heard = False
+        while time.monotonic() < deadline:
+            if not heard:
+                self.write_line("PING")
+            ping_deadline = min(time.monotonic() + PING_INTERVAL_SEC, deadline)
+            while time.monotonic() < ping_deadline:
+                try:
+                    event = await asyncio.wait_for(events.get(), ping_deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+                if event.kind == READY:
+                    return event.line
+                if event.kind in (PROMPT, SORT_PROMPT):
+                    # Waiting for input now: a buffered PING is answered within the interval
+                    heard = False
+                    ping_deadline = min(time.monotonic() + PING_INTERVAL_SEC, deadline)
+                elif event.kind != SERIAL_ERROR:
+                    heard = True
+        return None
+
+    def close(self):
+        with self._lock:
+            self._close_port()
+
+_links = {}
+_links_lock = threading.Lock()
+
+def get_link(port, baud_rate=9600):
+    """Returns the shared SerialLink for a port; the port is opened by connect()."""
+    with _links_lock:
+        link = _links.get(port)
+        if link is None or link.baud_rate != baud_rate:
+            if link is not None:
+                link.close()
+            link = SerialLink(port, baud_rate)
+            _links[port] = link
+        return link
+
+def close_all():
+    with _links_lock:
+        links = list(_links.values())
+        _links.clear()
+    for link in links:
+        link.close()
+
+atexit.register(close_all)
@@ -0,0 +1,137 @@
+"""
+Timing model of the slider and arm, with the constants of
+arduino_sketch/robot_arm_with_slider_final. Used by the pick scheduler to
+estimate how long a round takes for each occupied cell, and by the
+hardware-in-the-loop simulator to pace the fake Arduino.
+"""
+import math
+
+# --- Values from robot_arm_with_slider_final.ino ---
+STEPS_PER_CM = 50 * 8
+MAX_SPEED = 800 * 8          # steps/s
+ACCELERATION = 400 * 8       # steps/s^2
+HOMING_SPEED = 3200          # steps/s, constant speed runSpeed()
+HOME_CM = 0                  # The sketch re-homes after every round
+CELL_SIZES_CM = [8, 17, 26, 30]
+SCANNING_AREA_CM = 38
+CELL_WIDTH_CM_SORTED = 7
+SORTED_AREA_START_CM = {'b1': 52, 'b2': 52, 'b3': 69, 'b4': 69}
+SERVO_STEP_DELAY = 0.020     # stepDelay (ms -> s)
+SERVO_STEP_SIZE = 2
+DWELL_SEC = 1.0              # delay(1000) after every arm move
+DEFAULT_PULSE = [200, 320, 420, 150, 150, 220]
+
+SCAN_ESTIMATE_SEC = 1.0      # Typical voting scan at the scan station
+
+# (upper, target, targetClose, upperClose) pulse sets from the sketch
+ARM_POSES = {
+    'a': ([350, 180, 420, 220, 450, 240], [350, 280, 400, 410, 500, 240],
+          [200, 280, 400, 410, 500, 240], [220, 180, 420, 220, 450, 240]),
+    'b': ([350, 270, 390, 180, 250, 230], [350, 280, 390, 280, 320, 230],
+          [220, 280, 390, 280, 320, 230], [220, 270, 390, 180, 250, 230]),
+    'c': ([350, 450, 420, 300, 180, 220], [350, 450, 420, 350, 230, 220],
+          [220, 450, 420, 350, 230, 220], [220, 450, 420, 300, 180, 220]),
+    'scanningdrop': ([220, 270, 390, 180, 250, 230], [220, 280, 390, 280, 320, 230],
+                     [350, 280, 390, 280, 320, 230], [350, 150, 390, 200, 260, 230]),
+    'scanningpick': ([350, 280, 390, 280, 320, 230], [350, 280, 390, 280, 320, 230],
+                     [220, 280, 390, 280, 320, 230], [220, 270, 390, 180, 250, 230]),
+    'b13_odd': ([220, 450, 420, 280, 150, 220], [220, 450, 420, 340, 200, 220],
+                [350, 450, 420, 340, 200, 220], [350, 450, 420, 280, 150, 220]),
+    'b13_even': ([220, 280, 420, 190, 215, 220], [220, 320, 420, 250, 240, 220],
+                 [350, 320, 420, 250, 240, 220], [350, 280, 420, 190, 215, 220]),
+    'b24_odd': ([220, 200, 420, 150, 290, 220], [220, 220, 420, 250, 350, 220],
+                [350, 220, 420, 250, 350, 220], [350, 200, 420, 150, 290, 220]),
+    'b24_even': ([220, 160, 420, 150, 360, 220], [220, 230, 420, 360, 490, 220],
+                 [350, 230, 420, 360, 490, 220], [350, 160, 420, 250, 450, 220]),
+}
+
+def move_time(distance_steps):
+    """AccelStepper trapezoidal (or triangular) profile duration in seconds."""
+    d = abs(distance_steps)
+    if d == 0:
+        return 0.0
+    ramp_steps = MAX_SPEED ** 2 / ACCELERATION   # accelerate + decelerate
+    if d >= ramp_steps:
+        return d / MAX_SPEED + MAX_SPEED / ACCELERATION
+    return 2 * math.sqrt(d / ACCELERATION)
+
+def travel_time(from_cm, to_cm):
+    return move_time((to_cm - from_cm) * STEPS_PER_CM)
+
+def home_time(from_cm):
+    """homeStepper() runs at constant speed back to the limit switch."""
+    return from_cm * STEPS_PER_CM / HOMING_SPEED
+
+def servo_move_time(from_pulses, to_pulses):
+    """Duration of moveServosSmooth() between two poses."""
+    max_steps = max(abs(t - f) for f, t in zip(from_pulses, to_pulses)) or 1
+    return (max_steps // SERVO_STEP_SIZE + 1) * SERVO_STEP_DELAY
+
+def arm_time(pose, from_pulses=DEFAULT_PULSE, return_home=True):
+    """
+    Duration of robotarm() (or scanning() without `return_home`) for `pose`.
+    Returns:
+        tuple: (seconds, pulses the arm ends in)
+    """
+    seconds = 0.0
+    current = from_pulses
+    steps = list(ARM_POSES[pose]) + ([DEFAULT_PULSE] if return_home else [])
+    for pulses in steps:
+        seconds += servo_move_time(current, pulses) + DWELL_SEC
+        current = pulses
+    return seconds, current
+
+def cell_position_cm(cell_label):
+    """Slider position of a cell; the column letter indexes cellSizesCM."""
+    index = ord(cell_label[0]) - ord('A')
+    return CELL_SIZES_CM[index] if 0 <= index < len(CELL_SIZES_CM) else 0
+
+def sort_position_cm(tray_code, count=0):
+    """Slider position for the next item into `tray_code` after `count` items this session."""
+    return SORTED_AREA_START_CM[tray_code] + (count // 2) * CELL_WIDTH_CM_SORTED
+
+def sort_time(from_cm, tray_code, count=0):
+    """Travel to the tray, drop the item and re-home, as in triggerSortFunction()."""
+    cm = sort_position_cm(tray_code, count)
+    family = 'b13' if tray_code in ('b1', 'b3') else 'b24'
+    seconds, _ = arm_time(f"{family}_{'odd' if count % 2 == 1 else 'even'}")
+    return travel_time(from_cm, cm) + seconds + home_time(cm)
+
+def round_time(cell_label, tray_code=None, counts=None, start_cm=HOME_CM, scan_sec=SCAN_ESTIMATE_SEC, arm=None):
+    """
+    Expected seconds from sending the cell until the slider is home again,
+    picking with `arm` (default: the pose of the cell's row letter).
+    A known `tray_code` takes the direct path past the scan station;
+    otherwise the item goes through the scan station and the sort leg is
+    averaged over the trays. `counts` maps tray codes to the items already
+    sorted this session, which moves the drop position along the tray.
+    """
+    counts = counts or {}
+    cell_cm = cell_position_cm(cell_label)
+    pose = arm or (cell_label.split()[1] if len(cell_label.split()) > 1 else 'a')
+    pick_sec, _ = arm_time(pose if pose in ('a', 'b', 'c') else 'a')
+    seconds = travel_time(start_cm, cell_cm) + pick_sec
+    if tray_code is not None:
+        return seconds + sort_time(cell_cm, tray_code, counts.get(tray_code, 0))
+
+    drop_sec, pulses = arm_time('scanningdrop', return_home=False)
+    scan_pick_sec, _ = arm_time('scanningpick', from_pulses=pulses)
+    seconds += travel_time(cell_cm, SCANNING_AREA_CM) + drop_sec + scan_sec + scan_pick_sec
+    sort_legs = [sort_time(SCANNING_AREA_CM, code, counts.get(code, 0)) for code in SORTED_AREA_START_CM]
+    return seconds + sum(sort_legs) / len(sort_legs)
+
+def schedule_picks(cell_labels, codes=None, counts=None, start_cm=HOME_CM, avoid=None):
+    """
+    Orders occupied cells by expected round time, fastest first; cells with
+    a known tray code take the direct path and usually come first. Ties go
+    to the cell nearest `start_cm`, where the slider is when the round starts.
+    Cells in `avoid` (e.g. ones the arm keeps missing) are left out.
+    Returns:
+        list: (cell label, expected seconds) tuples
+    """
+    codes = codes or {}
+    avoid = avoid or ()
+    plan = [(label, round_time(label, codes.get(label), counts, start_cm))
+            for label in cell_labels if label not in avoid]
+    plan.sort(key=lambda item: (round(item[1], 3), abs(cell_position_cm(item[0]) - start_cm)))
+    return plan
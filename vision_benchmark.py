@@ -0,0 +1,327 @@
+"""
+Benchmark for the vision stages on a fixed frame corpus.
+
+Runs every tray-detection and QR stage over the same frames and reports
+per-stage latency percentiles, frames per second and memory allocated per
+call. Results are written as JSON so runs on different commits can be
+compared with --compare.
+
+The corpus is background.jpg, any recorded frames in data/frames/
+(capture some with --capture), synthetic tray frames with items drawn into
+tray_cells.json cells, and generated QR crops at several scales and blur
+levels.
+
+Usage:
+    python vision_benchmark.py --out bench.json
+    python vision_benchmark.py --out new.json --compare bench.json
+    python vision_benchmark.py --capture 20      # record tray frames from camera 0
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import qrcode
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(REPO_DIR, "python"))
+
+from automated_cell_selection import (
+    calculate_difference_otsu, calculate_difference_otsu_prepared, find_valid_blobs,
+)
+from automated_tray_sorting import looks_like_qr
+from background_model import prepare_gray, BACKGROUND_FILE
+from cell_map import load_cell_map
+from config_cache import get_crop_box
+from object_cell_detection import identify_valid_contours
+from qr_decoders import DECODERS
+
+FRAMES_DIR = os.path.join("data", "frames")
+RESULTS_FILE = os.path.join("data", "vision_benchmark.json")
+SYNTHETIC_ITEM_COUNTS = [0, 1, 3, 6, 9]
+QR_CODES = ['b1', 'b2', 'b3', 'b4']
+QR_SCALES = [0.3, 0.5, 0.8]          # QR side as a fraction of the crop's short side
+QR_BLUR_SIGMAS = [0, 1.0, 2.0, 3.0]
+DEFAULT_REPEAT = 20
+SEED = 1234
+
+# --- Corpus ---
+
+def load_recorded_frames(frames_dir=FRAMES_DIR):
+    paths = sorted(glob.glob(os.path.join(frames_dir, "*.jpg")) + glob.glob(os.path.join(frames_dir, "*.png")))
+    frames = []
+    for path in paths:
+        img = cv2.imread(path)
+        if img is not None:
+            frames.append((os.path.basename(path), img))
+    return frames
+
+def make_tray_frames(background, cell_map, rng):
+    """Background plus sensor noise, with items drawn into randomly chosen cells."""
+    frames = []
+    for count in SYNTHETIC_ITEM_COUNTS:
+        frame = background.astype(np.int16) + rng.normal(0, 2, background.shape).astype(np.int16)
+        frame = frame.clip(0, 255).astype(np.uint8)
+        chosen = rng.choice(len(cell_map.cells), size=min(count, len(cell_map.cells)), replace=False)
+        for idx in chosen:
+            cell = cell_map.cells[idx]
+            center = (cell["x"] + cell["w"] // 2, cell["y"] + cell["h"] // 2)
+            radius = int(min(cell["w"], cell["h"]) * 0.3)
+            patch = background[cell["y"]:cell["y"] + cell["h"], cell["x"]:cell["x"] + cell["w"]]
+            color = (30, 40, 120) if patch.mean() > 110 else (170, 200, 235)
+            cv2.circle(frame, center, radius, color, -1)
+        frames.append((f"synthetic_{count}_items", frame))
+    return frames
+
+def make_qr_crops(crop_shape, rng):
+    """Grayscale crops of the scan area with a QR code at each scale and blur level."""
+    h, w = crop_shape
+    crops = []
+    for code in QR_CODES:
+        qr = np.array(qrcode.make(code, border=2).convert("L"), dtype=np.uint8)
+        for scale in QR_SCALES:
+            size = int(min(h, w) * scale)
+            qr_resized = cv2.resize(qr, (size, size), interpolation=cv2.INTER_AREA)
+            for sigma in QR_BLUR_SIGMAS:
+                crop = rng.normal(110, 4, (h, w)).clip(0, 255).astype(np.uint8)
+                oy, ox = (h - size) // 2, (w - size) // 2
+                crop[oy:oy + size, ox:ox + size] = qr_resized
+                if sigma > 0:
+                    crop = cv2.GaussianBlur(crop, (0, 0), sigma)
+                crops.append({"code": code, "scale": scale, "blur": sigma, "image": crop})
+    empty = rng.normal(110, 4, (h, w)).clip(0, 255).astype(np.uint8)
+    crops.append({"code": None, "scale": 0, "blur": 0, "image": empty})
+    return crops
+
+# --- Measurement ---
+
+def time_calls(fn, inputs, repeat):
+    """Runs fn over every input `repeat` times; returns per-call seconds."""
+    times = []
+    for _ in range(repeat):
+        for args in inputs:
+            start = time.perf_counter()
+            fn(*args)
+            times.append(time.perf_counter() - start)
+    return times
+
+def measure_allocations(fn, inputs):
+    """Average bytes allocated per call and the peak over one pass (numpy/OpenCV buffers included)."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    total = 0
+    for args in inputs:
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return total / max(len(inputs), 1), peak - before
+
+def summarize(times, alloc_per_call, alloc_peak):
+    ms = np.array(times) * 1000
+    mean = float(ms.mean())
+    return {
+        "calls": len(times),
+        "mean_ms": round(mean, 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p90_ms": round(float(np.percentile(ms, 90)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "max_ms": round(float(ms.max()), 4),
+        "fps": round(1000 / mean, 1) if mean > 0 else None,
+        "alloc_kb_per_call": round(alloc_per_call / 1024, 1),
+        "alloc_peak_kb": round(max(alloc_peak, 0) / 1024, 1),
+    }
+
+# --- Stages ---
+
+def legacy_detect(frame, bg_img, cell_map):
+    """The pre-CellMap path: contours, per-contour filter and moments."""
+    height, width = frame.shape[:2]
+    diff = calculate_difference_otsu(frame, bg_img)
+    contours, _ = cv2.findContours(diff, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cells = []
+    for idx in identify_valid_contours(contours, height, width):
+        M = cv2.moments(contours[idx])
+        if M["m00"] != 0:
+            cells.append(cell_map.assign(int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"])))
+    return cells
+
+def current_detect(frame, bg_blur, cell_map):
+    """Same steps as detect_occupied_cells, without the background model and prints."""
+    diff = calculate_difference_otsu_prepared(prepare_gray(frame), bg_blur)
+    centroids, _ = find_valid_blobs(diff)
+    if len(centroids) == 0:
+        return []
+    centroids = centroids.astype(int)
+    return [label for label in cell_map.assign_many(centroids[:, 0], centroids[:, 1]) if label]
+
+def assign_centroids(cell_map, centroids):
+    centroids = centroids.astype(int)
+    return cell_map.assign_many(centroids[:, 0], centroids[:, 1])
+
+def available_decoders():
+    """Every registered QR backend that can run here."""
+    decoders = []
+    for name, factory in DECODERS.items():
+        decoder = factory()
+        if decoder.available():
+            decoders.append(decoder)
+    return decoders
+
+def build_stages(tray_frames, background, qr_crops):
+    cell_map = load_cell_map("tray_cells.json", background.shape)
+    bg_blur = prepare_gray(background)
+    frames = [frame for _, frame in tray_frames]
+    blurs = [prepare_gray(frame) for frame in frames]
+    diffs_legacy = [calculate_difference_otsu(frame, background) for frame in frames]
+    diffs = [calculate_difference_otsu_prepared(blur, bg_blur) for blur in blurs]
+    centroids = [find_valid_blobs(diff)[0] for diff in diffs]
+    qr_images = [c["image"] for c in qr_crops]
+
+    return [
+        ("calculate_difference_otsu", calculate_difference_otsu, [(f, background) for f in frames]),
+        ("findContours", lambda d: cv2.findContours(d, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE), [(d,) for d in diffs_legacy]),
+        ("identify_valid_contours", identify_valid_contours,
+         [(cv2.findContours(d, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0],) + d.shape[:2] for d in diffs_legacy]),
+        ("legacy_detect_total", legacy_detect, [(f, background, cell_map) for f in frames]),
+        ("prepare_gray", prepare_gray, [(f,) for f in frames]),
+        ("calculate_difference_otsu_prepared", calculate_difference_otsu_prepared, [(b, bg_blur) for b in blurs]),
+        ("find_valid_blobs", find_valid_blobs, [(d,) for d in diffs]),
+        ("assign_cells", assign_centroids, [(cell_map, c) for c in centroids if len(c)]),
+        ("detect_total", current_detect, [(f, bg_blur, cell_map) for f in frames]),
+        ("looks_like_qr", looks_like_qr, [(img,) for img in qr_images]),
+    ] + [
+        (f"decode_{decoder.name}", decoder.decode, [(img,) for img in qr_images])
+        for decoder in available_decoders()
+    ]
+
+def qr_decode_rates(qr_crops):
+    """Fraction of QR crops decoded correctly per backend and (scale, blur)."""
+    result = {}
+    for decoder in available_decoders():
+        rates = {}
+        for crop in qr_crops:
+            if crop["code"] is None:
+                continue
+            key = f"scale={crop['scale']},blur={crop['blur']}"
+            reads = decoder.decode(crop["image"])
+            ok = bool(reads) and reads[0].data == crop["code"]
+            hits, total = rates.get(key, (0, 0))
+            rates[key] = (hits + ok, total + 1)
+        result[decoder.name] = {key: round(hits / total, 3) for key, (hits, total) in rates.items()}
+    return result
+
+# --- Runs ---
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(repeat=DEFAULT_REPEAT, frames_dir=FRAMES_DIR):
+    background = cv2.imread(BACKGROUND_FILE)
+    if background is None:
+        raise FileNotFoundError(f"'{BACKGROUND_FILE}' not found. Run save_background_image.py first.")
+    rng = np.random.default_rng(SEED)
+    cell_map = load_cell_map("tray_cells.json", background.shape)
+    recorded = load_recorded_frames(frames_dir)
+    tray_frames = [("background", background)] + recorded + make_tray_frames(background, cell_map, rng)
+    crop_shape = background[get_crop_box(background.shape).slices].shape[:2]
+    qr_crops = make_qr_crops(crop_shape, rng)
+
+    stages = {}
+    for name, fn, inputs in build_stages(tray_frames, background, qr_crops):
+        if not inputs:
+            continue
+        fn(*inputs[0])  # Warm-up
+        times = time_calls(fn, inputs, repeat)
+        alloc_per_call, alloc_peak = measure_allocations(fn, inputs)
+        stages[name] = summarize(times, alloc_per_call, alloc_peak)
+        print(f"{name:36s} p50 {stages[name]['p50_ms']:8.3f} ms  p99 {stages[name]['p99_ms']:8.3f} ms  "
+              f"{stages[name]['fps']:>9} fps  {stages[name]['alloc_kb_per_call']:8.1f} KB/call")
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "repeat": repeat,
+        "corpus": {
+            "frame_shape": list(background.shape[:2]),
+            "recorded_frames": len(recorded),
+            "synthetic_frames": len(SYNTHETIC_ITEM_COUNTS),
+            "qr_crops": len(qr_crops),
+            "qr_crop_shape": list(crop_shape),
+        },
+        "stages": stages,
+        "qr_decode_rate": qr_decode_rates(qr_crops),
+    }
+
+def compare(result, baseline):
+    """Prints the p50 change of every stage against a previous run."""
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for name, stats in result["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old or not old["p50_ms"]:
+            continue
+        change = (stats["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+        print(f"  {name:36s} {old['p50_ms']:8.3f} -> {stats['p50_ms']:8.3f} ms  ({change:+.1f}%)")
+
+def capture_frames(count, camera_index=0, frames_dir=FRAMES_DIR, interval_sec=0.5):
+    """Saves `count` tray frames from the camera into the recorded corpus."""
+    from camera_manager import get_camera
+    os.makedirs(frames_dir, exist_ok=True)
+    camera = get_camera(camera_index)
+    last = None
+    for i in range(count):
+        frame, last = camera.get_frame(newer_than=last)
+        if frame is None:
+            print("Failed to grab frame.")
+            return
+        path = os.path.join(frames_dir, f"tray_{time.strftime('%Y%m%d_%H%M%S')}_{i:03d}.png")
+        cv2.imwrite(path, frame)
+        print(f"Saved {path}")
+        time.sleep(interval_sec)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vision stages on a fixed frame corpus.")
+    parser.add_argument("--out", default=RESULTS_FILE, help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Passes over the corpus per stage")
+    parser.add_argument("--frames", default=FRAMES_DIR, help="Directory with recorded tray frames")
+    parser.add_argument("--capture", type=int, metavar="N", help="Record N tray frames from the camera and exit")
+    parser.add_argument("--camera", type=int, default=0, help="Camera index for --capture")
+    args = parser.parse_args()
+
+    if args.capture:
+        capture_frames(args.capture, camera_index=args.camera, frames_dir=args.frames)
+        return
+
+    result = run_benchmark(repeat=args.repeat, frames_dir=args.frames)
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(result, f, indent=2)
+    for name, rates in result['qr_decode_rate'].items():
+        print(f"\nQR decode rate ({name}): {rates}")
+    print(f"Results written to {args.out}")
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(result, json.load(f))
+
+if __name__ == "__main__":
+    main()